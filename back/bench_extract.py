@@ -0,0 +1,123 @@
+import os
+import glob
+import time
+import argparse
+import tempfile
+from html import escape
+from parsel import Selector
+from extractor import HotelExtractor
+
+DESCRIPTION_PATH = [3, 1, 5, 1, 1, 3, 1, 1, 1, 1, 1, 1, 2, 1]
+SUBSCORES = ["Personnel", "Équipements", "Propreté", "Confort",
+             "Rapport qualité/prix", "Situation géographique", "Connexion Wi-Fi gratuite"]
+
+
+def _nest(path: list, leaf: str) -> str:
+    '''
+    Builds nested divs where the leaf sits at the given 1-based div positions.
+    '''
+    if not path:
+        return leaf
+    position, rest = path[0], path[1:]
+    siblings = "<div></div>" * (position - 1)
+    return f"{siblings}<div>{_nest(rest, leaf)}</div>"
+
+
+def render_hotel_page(index: int, city: str = "Paris") -> str:
+    '''
+    Renders a synthetic booking.com hotel page matching the default selectors.\n
+    Args:
+        index (int): Number of the hotel, drives its name and scores.
+        city (str, optional): City of the hotel. Defaults to Paris.
+    Returns:
+        str: The HTML page.
+    '''
+    def score(offset: int) -> str:
+        return f"{5 + (index + offset) % 50 / 10:.1f}".replace(".", ",")
+
+    subscores = "".join(
+        f'<div data-testid="review-subscore"><span class="be887614c2">{label}</span>'
+        f'<div class="ccb65902b2 efcd70b4c4">{score(i)}</div></div>'
+        for i, label in enumerate(SUBSCORES)
+    )
+    lat, lon = 43 + index % 700 / 100, 1 + index % 500 / 100
+    header = (
+        f'<h2 class="d2fee87262 pp-header__title">Hôtel {index} {escape(city)}</h2>'
+        f'<p class="review_score_value">{score(7)}</p>'
+        f'<a class="big_review_score_detailed"><div class="abf093bdfe">'
+        f'{index * 7 % 5000 + 1} expériences vécues</div></a>'
+        f'<a id="hotel_sidebar_static_map" data-atlas-latlng="{lat},{lon}"></a>'
+        f"{subscores}"
+    )
+    description = f"<p>Hôtel {index} situé au cœur de {escape(city)}, à deux pas des monuments.</p>"
+    # the description sits in the third div of the body
+    return (
+        '<html><head><meta charset="utf-8"><title>Hotel</title></head><body>'
+        f"<div></div><div>{header}</div><div>{_nest(DESCRIPTION_PATH[1:], description)}</div>"
+        "</body></html>"
+    )
+
+
+def write_pages(directory: str, count: int) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, f"hotel_{i}.html"), "w", encoding="utf-8") as file:
+            file.write(render_hotel_page(i))
+
+
+def legacy_extract(body: bytes) -> tuple:
+    '''
+    Scrapy selector queries used by HotelSpider.parse_hotel_details before the
+    lxml extraction layer.
+    '''
+    response = Selector(body=body, type="html")
+    fields = {
+        "name": response.css('h2.d2fee87262.pp-header__title::text').get(),
+        "rating": response.css('p.review_score_value::text').get(),
+        "description": response.xpath('/html/body/div[3]/div/div[5]/div[1]/div[1]/div[3]/div/div/div[1]/div[1]/div[1]/div[1]/div[2]/div/p/text()').get(),
+        "reviews": response.css('a.big_review_score_detailed div.abf093bdfe::text').get(),
+        "coordinates": response.css('a#hotel_sidebar_static_map::attr(data-atlas-latlng)').get(),
+    }
+    review_elements = response.css('div[data-testid="review-subscore"]')
+    special_rate = {review.css('span.be887614c2::text').get(): review.css('div.ccb65902b2.efcd70b4c4::text').get() for review in review_elements}
+    return fields, special_rate
+
+
+def run(name: str, extract, pages: list, repeat: int) -> list:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [extract(body) for body in pages]
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10} {len(pages) * repeat / elapsed:>12,.0f} pages/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay saved hotel pages through the extractors")
+    parser.add_argument("directory", nargs="?", help="directory of saved hotel .html pages")
+    parser.add_argument("--generate", type=int, default=1000,
+                        help="number of synthetic pages used when no directory is given")
+    parser.add_argument("--selectors", help="selector config of the lxml extractor")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.directory
+        if directory is None:
+            directory = tmp
+            write_pages(directory, args.generate)
+        pages = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+            with open(path, "rb") as file:
+                pages.append(file.read())
+
+    extractor = HotelExtractor(args.selectors) if args.selectors else HotelExtractor()
+    print(f"{len(pages)} pages")
+    legacy = run("scrapy", legacy_extract, pages, args.repeat)
+    fast = run("lxml", extractor.extract, pages, args.repeat)
+    mismatches = sum(a != b for a, b in zip(legacy, fast))
+    print(f"{mismatches} pages extracted differently")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import os
+import re
+import glob
+import logging
+import json
+import time
+import datetime
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bench_extract import render_hotel_page
+
+HOTEL_PATH = re.compile(r"/hotel/fr/(.+)-(\d+)\.fr\.html")
+
+
+def city_page(city: str, hotels: int) -> str:
+    '''
+    Renders a city page listing hotels the way HotelSpider.parse expects them.
+    '''
+    links = "".join(
+        f'<div class="c6666c448e"><a href="/hotel/fr/{city}-{i}.fr.html">Hôtel {i}</a></div>'
+        for i in range(hotels)
+    )
+    return f'<html><head><meta charset="utf-8"></head><body>{links}</body></html>'
+
+
+def forecast(city: str) -> dict:
+    '''
+    Canned OpenWeatherMap 5 day forecast, 40 readings 3 hours apart.
+    '''
+    start = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    sunrise = int(start.timestamp()) + 7 * 3600
+    readings = []
+    for i in range(40):
+        temp = 10 + (len(city) + i) % 15
+        readings.append({
+            'dt_txt': f'{start + datetime.timedelta(hours=3 * i):%Y-%m-%d %H:%M:%S}',
+            'main': {'temp': temp, 'feels_like': temp - 1.5},
+            'weather': [{'main': ['Clear', 'Clouds', 'Rain'][i % 3]}],
+        })
+    return {'city': {'sunrise': sunrise, 'sunset': sunrise + 11 * 3600}, 'list': readings}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Serves booking.com city and hotel pages, Nominatim and OpenWeatherMap
+    responses from memory. The server holds the hotels per city and the
+    recorded hotel pages, if any.
+    '''
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type: str) -> None:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        hotel = HOTEL_PATH.match(url.path)
+        if url.path.startswith('/city/fr/'):
+            city = url.path[len('/city/fr/'):-len('.fr.html')]
+            self._send(city_page(city, self.server.hotels), 'text/html; charset=utf-8')
+        elif hotel:
+            city, index = hotel.group(1), int(hotel.group(2))
+            if self.server.pages:
+                body = self.server.pages[(hash(city) + index) % len(self.server.pages)]
+            else:
+                body = render_hotel_page(index, city.replace('-', ' '))
+            self._send(body, 'text/html; charset=utf-8')
+        elif url.path == '/search':
+            city = query['city'][0]
+            coordinates = [{'lat': str(43 + len(city) % 7), 'lon': str(1 + len(city) % 6)}]
+            self._send(json.dumps(coordinates), 'application/json')
+        elif url.path == '/data/2.5/forecast':
+            self._send(json.dumps(forecast(query['lat'][0])), 'application/json')
+        else:
+            self.send_error(404)
+
+
+def start_server(hotels: int, pages: list) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.hotels = hotels
+    server.pages = pages
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def version() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Bench:
+    '''
+    Times the stages of the pipeline one after the other so each one gets
+    its own throughput.
+    '''
+
+    def __init__(self):
+        self.stages = {}
+
+    def stage(self, name: str, unit: str, func):
+        start = time.perf_counter()
+        result, amount = func()
+        elapsed = time.perf_counter() - start
+        self.stages[name] = {'seconds': elapsed, 'amount': amount, 'unit': unit,
+                             'throughput': amount / elapsed if elapsed else 0.0}
+        shown = f"{amount:,.0f}" if amount >= 100 else f"{amount:.3g}"
+        print(f"{name:>14} {shown:>12} {unit:<9} {elapsed:>8.2f}s "
+              f"{self.stages[name]['throughput']:>12,.1f} {unit}/s")
+        return result
+
+
+def run(args, workdir: str) -> dict:
+    '''
+    Runs geocoding, weather calls, crawl, S3 uploads and both ETL loads
+    against the local stand-ins.
+    '''
+    # the base urls and credentials are read when the modules are imported
+    from caller import WeatherCall
+    from geocache import GeocodeCache
+    from scraper import Crawler, HotelSpider
+    from big_data import get_aws, MB
+    from etl import Kayak
+    from lake import DataLake
+    from metrics import metrics
+    from param import tables, hotels_storage
+
+    cities = [f'City {i}' for i in range(args.cities)]
+    feed = 'bookings_hotels.jsonl.gz'
+    sources = {'weather': 'weather.json', 'weather_forecast': 'weather_forecast.json',
+               'hotels': feed}
+    bench = Bench()
+    print(f"{'stage':>14} {'amount':>12} {'unit':<9} {'time':>9} {'throughput':>17}")
+
+    caller = WeatherCall(cities, max_workers=args.weather_workers,
+                         geocache=GeocodeCache('geocode.db'), fetch=False)
+    coordinates = bench.stage('geocode', 'cities', lambda: (caller.geocode(), len(cities)))
+
+    def weather():
+        caller.weather = caller.get_cities_weather(coordinates)
+        caller.save(sources['weather'])
+        caller.save_forecast(sources['weather_forecast'])
+        return None, len(caller.forecast)
+    bench.stage('weather', 'readings', weather)
+
+    def crawl():
+        Crawler(HotelSpider, cities, feed, shards=args.shards,
+                settings={'LOG_LEVEL': 'WARNING', 'AUTOTHROTTLE_ENABLED': False,
+                          'CONCURRENT_REQUESTS': args.concurrency})
+        return None, metrics.total('crawl_items')
+    bench.stage('crawl', 'hotels', crawl)
+
+    def upload():
+        aws = get_aws()
+        for source in sources.values():
+            aws.push_to_s3(source, compression=args.compression)
+        return None, metrics.total('s3_bytes', direction='upload') / MB
+    bench.stage('s3_upload', 'MB', upload)
+
+    lake = DataLake(os.path.join(workdir, 'lake')) if args.lake else None
+    kayak = Kayak(tables, sources=sources, load_mode=args.load_mode,
+                  chunksize=args.chunksize, lake=lake, hotels_storage=hotels_storage,
+                  run=False)
+    bench.stage('weather_etl', 'rows', lambda: (
+        (kayak.transfrom_weather(), kayak.transform_forecast()),
+        metrics.total('rows_loaded', table='weather')
+        + metrics.total('rows_loaded', table='weather_forecast')))
+    bench.stage('hotels_etl', 'rows', lambda: (
+        kayak.transform_hotels(), metrics.total('rows_loaded', table='hotels')))
+    return bench.stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the whole pipeline offline')
+    parser.add_argument('--cities', type=int, default=10)
+    parser.add_argument('--hotels', type=int, default=100, help='hotels per city')
+    parser.add_argument('--pages', help='directory of recorded hotel .html pages, '
+                                        'synthetic pages are served otherwise')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='concurrent requests of each crawl shard')
+    parser.add_argument('--weather-workers', type=int, default=8)
+    parser.add_argument('--compression', default='gzip', choices=['gzip', 'zstd', 'none'])
+    parser.add_argument('--database', help='SQLAlchemy url of the target, '
+                                           'a temporary SQLite file by default')
+    parser.add_argument('--load-mode', default='copy', choices=['copy', 'insert'])
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--lake', action='store_true', help='also write the local Parquet lake')
+    parser.add_argument('--s3-endpoint', help='url of a local S3 such as MinIO, '
+                                              'an in-process moto mock by default')
+    parser.add_argument('--output', default='bench_history.jsonl',
+                        help='JSON Lines file the results are appended to')
+    args = parser.parse_args()
+    # the crawl lowers the root logger level, handlers keep the output readable
+    logging.basicConfig(level=logging.WARNING)
+    for handler in logging.root.handlers:
+        handler.setLevel(logging.WARNING)
+    args.compression = None if args.compression == 'none' else args.compression
+    output = os.path.abspath(args.output)
+
+    pages = []
+    if args.pages:
+        for path in sorted(glob.glob(os.path.join(args.pages, '*.html'))):
+            with open(path, 'rb') as file:
+                pages.append(file.read())
+    server = start_server(args.hotels, pages)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update({
+            'BOOKING_URL': base_url,
+            'NOMINATIM_URL': base_url,
+            'OPENWEATHER_URL': base_url,
+            'APIKEY': 'bench',
+            'POSTGRES': args.database or f'sqlite:///{os.path.join(workdir, "kayak.db")}',
+            'AWS_ACCESS_ID': 'bench',
+            'AWS_ACCESS_KEY': 'bench',
+            'AWS_BUCKET': 'kayak-bench',
+            'AWS_DEFAULT_REGION': 'eu-west-3',
+        })
+        os.chdir(workdir)
+        if args.s3_endpoint:
+            os.environ['AWS_ENDPOINT_URL'] = args.s3_endpoint
+            stages = run(args, workdir)
+        else:
+            from moto import mock_aws
+            with mock_aws():
+                stages = run(args, workdir)
+    server.shutdown()
+
+    result = {
+        'version': version(),
+        'date': datetime.datetime.now().isoformat(),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'stages': stages,
+    }
+    with open(output, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(result) + '\n')
+    print(f"Results appended to {output}")
+
+
+if __name__ == '__main__':
+    main()
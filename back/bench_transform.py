@@ -0,0 +1,127 @@
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from etl import SUBSCORES, clean_hotels
+
+DT_PARTITION = "2024-01-01"
+
+
+def legacy_clean_hotels(hotels: pd.DataFrame, dt_partition: str) -> pd.DataFrame:
+    """
+    Row by row transform used by Kayak.transform_hotels before vectorization.
+    """
+    def get_float(x):
+        try:
+            return float(x.replace(",", "."))
+        except AttributeError:
+            return x
+        except ValueError:
+            return x
+
+    hotels = hotels.rename(SUBSCORES, axis=1)
+    hotels["reviews"] = hotels["reviews"].apply(
+        lambda x: int("".join(x.split(" ")[:-2]))
+    )
+    hotels["lat"] = (
+        hotels["coordinates"].apply(
+            lambda x: x.split(",")[0]).astype(float)
+    )
+    hotels["lon"] = (
+        hotels["coordinates"].apply(
+            lambda x: x.split(",")[1]).astype(float)
+    )
+    hotels.drop("coordinates", axis=1, inplace=True)
+    for col in SUBSCORES.values():
+        hotels[col] = hotels[col].apply(get_float)
+    hotels["rating"] = hotels["rating"].str.replace(",", ".").astype(float)
+    hotels["dt_partition"] = dt_partition
+    return hotels
+
+
+def french_decimal(values: np.ndarray) -> np.ndarray:
+    return np.char.replace(np.round(values, 1).astype(str), ".", ",")
+
+
+def generate_hotels(rows: int, filepath: str, seed: int = 0) -> None:
+    '''
+    Writes a synthetic bookings_hotels.json shaped like the HotelSpider feed.\n
+    Args:
+        rows (int): Number of hotels to generate.
+        filepath (str): Path of the JSON file to write.
+        seed (int, optional): Random seed. Defaults to 0.
+    '''
+    rng = np.random.default_rng(seed)
+    reviews = rng.integers(1, 20000, rows)
+    lat = rng.uniform(42.0, 51.0, rows)
+    lon = rng.uniform(-4.5, 8.0, rows)
+    hotels = pd.DataFrame({
+        "name": [f"Hotel {i}" for i in range(rows)],
+        "city": rng.choice(["Paris", "Lyon", "St-Malo", "Aix-en-Provence"], rows),
+        "rating": french_decimal(rng.uniform(5, 10, rows)),
+        "description": "Situé à quelques pas du centre-ville, cet hôtel propose des chambres.",
+        "reviews": [f"{n:,}".replace(",", " ") + " expériences vécues" for n in reviews],
+        "coordinates": np.char.add(np.char.add(lat.astype(str), ","), lon.astype(str)),
+        "url": [f"/hotel/fr/hotel-{i}.fr.html" for i in range(rows)],
+    })
+    for col in SUBSCORES:
+        scores = pd.Series(french_decimal(rng.uniform(5, 10, rows)), dtype=object)
+        # some hotels have no score for a category
+        scores[rng.random(rows) < 0.05] = None
+        hotels[col] = scores
+    hotels.to_json(filepath, orient="records", force_ascii=False)
+
+
+def measure(transform, raw: pd.DataFrame) -> tuple:
+    '''
+    Runs a transform on copies of the raw frame, once for timing and once
+    under tracemalloc, whose overhead would skew the timing.\n
+    Arrow buffers are not seen by tracemalloc, they are counted through a
+    proxy memory pool and added to the peak.\n
+    Returns:
+        tuple: Cleaned frame, elapsed seconds and peak memory in bytes.
+    '''
+    copy = raw.copy()
+    start = time.perf_counter()
+    cleaned = transform(copy, DT_PARTITION)
+    elapsed = time.perf_counter() - start
+
+    copy = raw.copy()
+    default_pool = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(default_pool)
+    pa.set_memory_pool(pool)
+    tracemalloc.start()
+    transform(copy, DT_PARTITION)
+    peak = tracemalloc.get_traced_memory()[1] + pool.max_memory()
+    tracemalloc.stop()
+    pa.set_memory_pool(default_pool)
+    return cleaned, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hotels transform")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'impl':>10} {'rows/s':>12} {'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.sizes:
+            filepath = os.path.join(tmp, "bookings_hotels.json")
+            generate_hotels(rows, filepath)
+            raw = pd.read_json(filepath)
+            results = {}
+            for impl, transform in [("legacy", legacy_clean_hotels),
+                                    ("vectorized", clean_hotels)]:
+                cleaned, elapsed, peak = measure(transform, raw)
+                results[impl] = cleaned
+                print(f"{rows:>10} {impl:>10} {rows / elapsed:>12,.0f} {peak / 2**20:>10.1f}")
+            pd.testing.assert_frame_equal(results["legacy"], results["vectorized"])
+
+
+if __name__ == "__main__":
+    main()
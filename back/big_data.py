@@ -1,8 +1,23 @@
 import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
 import datetime
 import boto3
 import logging
+import threading
 from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from boto3.s3.transfer import TransferConfig
+from metrics import metrics
+
+MB = 1024 ** 2
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+# raw uploads are named <name>_YYYY-MM-DD.<extension>
+DATED_KEY = re.compile(r"_(\d{4}-\d{2}-\d{2})\.")
 
 
 class AwsInstance(boto3.Session):
@@ -13,48 +28,142 @@ class AwsInstance(boto3.Session):
     pushing data to S3, and handling late data pushing.
     """
 
-    def __init__(self):
+    def __init__(self, max_concurrency: int = 10, chunksize: int = 16 * MB):
         access = os.getenv("AWS_ACCESS_ID")
         key = os.getenv("AWS_ACCESS_KEY")
         self.bucket_name = os.getenv("AWS_BUCKET")
         super().__init__(aws_access_key_id=access, aws_secret_access_key=key)
-        self.s3 = self.resource("s3")
-        self.create_bucket()
+        # AWS_ENDPOINT_URL points the client to a local S3 such as MinIO or moto,
+        # clients unlike resources can be shared by threads
+        self.s3 = self.client("s3", endpoint_url=os.getenv("AWS_ENDPOINT_URL"))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunksize,
+            multipart_chunksize=chunksize,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        )
+        self._bucket_checked = False
+        self._bucket_lock = threading.Lock()
 
     def create_bucket(self) -> None:
         """
-        Pushes a file to an Amazon S3 bucket after appending the current date to its name.\n
+        Creates the bucket of the project when missing.\n
+        The check is only sent once per instance, before the first upload or
+        the first use of the lake.
+        """
+        with self._bucket_lock:
+            if self._bucket_checked:
+                return
+            try:
+                self.s3.create_bucket(
+                    Bucket=self.bucket_name,
+                    CreateBucketConfiguration={"LocationConstraint": "eu-west-3"},
+                )
+            except Exception:
+                logging.info(f"Bucket {self.bucket_name} exist")
+            self._bucket_checked = True
+
+    @staticmethod
+    def _sha256(filepath: str) -> str:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as file:
+            for block in iter(lambda: file.read(MB), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _compress(filepath: str, compression: str) -> str:
+        """
+        Compresses a file next to the original one.\n
         Args:
-            filepath (str): The local filepath of the file to be pushed to S3.
+            filepath (str): The local filepath of the file to compress.
+            compression (str): "gzip" or "zstd", zstd needs the zstandard package.
+        Returns:
+            str: The filepath of the compressed file.
         """
-        try:
-            self.s3.create_bucket(
-                Bucket=self.bucket_name,
-                CreateBucketConfiguration={"LocationConstraint": "eu-west-3"},
-            )
-        except Exception:
-            logging.info(f"Bucket {self.bucket_name} exist")
+        compressed = filepath + COMPRESSIONS[compression]
+        with open(filepath, "rb") as source, open(compressed, "wb") as target:
+            if compression == "gzip":
+                # mtime=0 keeps the output identical for identical inputs
+                with gzip.GzipFile(fileobj=target, mode="wb", mtime=0) as archive:
+                    shutil.copyfileobj(source, archive, MB)
+            else:
+                import zstandard
+
+                zstandard.ZstdCompressor(level=10, threads=-1).copy_stream(source, target)
+        return compressed
 
-    def push_to_s3(self, filepath: str) -> None:
+    def _find_duplicate(self, digest: str):
+        """
+        Looks for an already uploaded file with the same content.\n
+        Args:
+            digest (str): SHA-256 of the file content.
+        Returns:
+            str: Key of the identical object still present in the bucket, or None.
+        """
+        if not os.path.exists("s3_hashes.log"):
+            return None
+        with open("s3_hashes.log", "r", encoding="UTF-8") as file:
+            keys = [line.split()[1] for line in file if line.startswith(digest)]
+        for key in reversed(keys):
+            try:
+                self.s3.head_object(Bucket=self.bucket_name, Key=key)
+                return key
+            except Exception:
+                continue
+        return None
+
+    def push_to_s3(self, filepath: str, compression: str = None) -> None:
         """
         Uploads a file to an AWS S3 bucket and logs the upload.\n
+        Files larger than the transfer chunksize are sent as parallel multipart
+        uploads, and a file whose content was already uploaded is skipped.\n
         Args:
             filepath (str): The local filepath of the file to be uploaded.
+            compression (str, optional): "gzip" or "zstd" to compress the file
+                before upload. Files already compressed are sent as is.
         """
-        bucket = self.s3.Bucket(self.bucket_name)
+        self.create_bucket()
         # get name for s3
         uploaded_file = filepath.split(".")
         date = datetime.date.today().strftime("%Y-%m-%d")
         uploaded_file[0] = uploaded_file[0] + "_" + date
         uploaded_file = ".".join(uploaded_file)
+
+        digest = self._sha256(filepath)
+        duplicate = self._find_duplicate(digest)
+        if duplicate is not None:
+            logging.info(f"{filepath} already uploaded as {duplicate}, skipping")
+            metrics.count("s3_uploads", result="duplicate")
+            return
+
+        to_upload = filepath
+        if compression and not filepath.endswith(tuple(COMPRESSIONS.values())):
+            to_upload = self._compress(filepath, compression)
+            uploaded_file += COMPRESSIONS[compression]
         # push zipped file to s3
         try:
-            bucket.upload_file(filepath, uploaded_file)
+            with metrics.timer("s3_upload"):
+                self.s3.upload_file(
+                    to_upload,
+                    self.bucket_name,
+                    uploaded_file,
+                    ExtraArgs={"Metadata": {"sha256": digest}},
+                    Config=self.transfer_config,
+                )
+            metrics.count("s3_uploads", result="uploaded")
+            metrics.count("s3_bytes", os.path.getsize(to_upload), direction="upload")
             with open("s3_files.log", "a", encoding="UTF-8") as file:
                 file.write(uploaded_file)
                 file.write("\n")
+            with open("s3_hashes.log", "a", encoding="UTF-8") as file:
+                file.write(f"{digest} {uploaded_file}\n")
         except Exception as e:
+            metrics.count("s3_uploads", result="failed")
             print(e)
+        finally:
+            if to_upload != filepath:
+                os.remove(to_upload)
 
     def load_from_s3(self, last_uploaded: str, directory: str) -> None:
         """
@@ -63,10 +172,127 @@ class AwsInstance(boto3.Session):
             last_uploaded (str): The name of the file to be downloaded from S3.
             directory (str): The local directory where the file will be saved.
         """
-        bucket = self.s3.Bucket(self.bucket_name)
         dir_ = os.path.join("data", directory)
         local_filepath = os.path.join(dir_, last_uploaded)
         if not os.path.exists(dir_):
             os.makedirs(dir_)
             print(f"Directory '{dir_}' created.")
-        bucket.download_file(last_uploaded, local_filepath)
+        with metrics.timer("s3_download"):
+            self.s3.download_file(self.bucket_name, last_uploaded, local_filepath)
+        metrics.count("s3_bytes", os.path.getsize(local_filepath), direction="download")
+
+    def _list_dated_keys(self, prefix: str, start: str, end: str) -> list:
+        """
+        Lists the raw uploads of the bucket whose date lies in [start, end].
+        """
+        paginator = self.s3.get_paginator("list_objects_v2")
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                match = DATED_KEY.search(obj["Key"])
+                if match is None:
+                    continue
+                date = match.group(1)
+                if (start and date < start) or (end and date > end):
+                    continue
+                objects.append(obj)
+        return objects
+
+    def sync(self, directory: str, prefix: str = "", start: str = None,
+             end: str = None, workers: int = 8) -> list:
+        """
+        Mirrors the raw uploads of the bucket into a local directory.\n
+        Files are downloaded in parallel to a .part file renamed once complete,
+        and recorded with their ETag in a .sync_manifest.json file. Files already
+        present with a matching ETag or size are skipped, so an interrupted sync
+        resumes where it stopped.\n
+        Args:
+            directory (str): The local directory under data/ where files are saved.
+            prefix (str, optional): Only sync keys starting with prefix.
+            start (str, optional): First upload date to sync, YYYY-MM-DD.
+            end (str, optional): Last upload date to sync, YYYY-MM-DD.
+            workers (int, optional): Number of parallel downloads. Defaults to 8.
+        Returns:
+            list: The downloaded keys.
+        """
+        dir_ = os.path.join("data", directory)
+        os.makedirs(dir_, exist_ok=True)
+        manifest_path = os.path.join(dir_, ".sync_manifest.json")
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="UTF-8") as file:
+                manifest = json.load(file)
+        lock = threading.Lock()
+
+        def is_synced(obj: dict) -> bool:
+            local_filepath = os.path.join(dir_, obj["Key"])
+            if not os.path.exists(local_filepath):
+                return False
+            if manifest.get(obj["Key"]) == obj["ETag"]:
+                return True
+            return os.path.getsize(local_filepath) == obj["Size"]
+
+        def download(obj: dict) -> str:
+            local_filepath = os.path.join(dir_, obj["Key"])
+            os.makedirs(os.path.dirname(local_filepath), exist_ok=True)
+            with metrics.timer("s3_download"):
+                self.s3.download_file(
+                    self.bucket_name, obj["Key"], local_filepath + ".part",
+                    Config=self.transfer_config,
+                )
+            metrics.count("s3_bytes", obj["Size"], direction="download")
+            os.replace(local_filepath + ".part", local_filepath)
+            with lock:
+                manifest[obj["Key"]] = obj["ETag"]
+                with open(manifest_path + ".tmp", "w", encoding="UTF-8") as file:
+                    json.dump(manifest, file)
+                os.replace(manifest_path + ".tmp", manifest_path)
+            return obj["Key"]
+
+        pending = [obj for obj in self._list_dated_keys(prefix, start, end)
+                   if not is_synced(obj)]
+        logging.info(f"Syncing {len(pending)} files to {dir_}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(download, pending))
+
+    def lake(self, prefix: str = "lake"):
+        """
+        Opens the Parquet data lake stored in the bucket.\n
+        Args:
+            prefix (str, optional): Key prefix of the lake. Defaults to "lake".
+        Returns:
+            DataLake: Lake rooted at s3://<bucket>/<prefix>.
+        """
+        from pyarrow import fs
+        from lake import DataLake
+
+        # the lake may be written before anything was uploaded in this run
+        self.create_bucket()
+        credentials = self.get_credentials()
+        options = {
+            "access_key": credentials.access_key if credentials else None,
+            "secret_key": credentials.secret_key if credentials else None,
+            "region": self.region_name or "eu-west-3",
+        }
+        endpoint = os.getenv("AWS_ENDPOINT_URL")
+        if endpoint:
+            endpoint = urlsplit(endpoint)
+            options["endpoint_override"] = endpoint.netloc
+            options["scheme"] = endpoint.scheme
+        return DataLake(f"{self.bucket_name}/{prefix}", fs.S3FileSystem(**options))
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_aws() -> AwsInstance:
+    """
+    Returns the AwsInstance shared by the stages of the process, created on
+    first use so runs without S3 access never build a session.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AwsInstance()
+        return _shared
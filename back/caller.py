@@ -1,37 +1,155 @@
 import os
 import json
+import time
 import logging
+import threading
 import requests
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from big_data import AwsInstance
+from big_data import get_aws
+from geocache import GeocodeCache
+from metrics import metrics
 
 load_dotenv()
 
+# base urls of the APIs, pointed to local stand-ins by the offline benchmark
+NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+OPENWEATHER_URL = os.getenv('OPENWEATHER_URL', 'https://api.openweathermap.org')
+# Nominatim usage policy allows at most one request per second
+DEFAULT_RATE_LIMITS = {
+    'nominatim.openstreetmap.org': 1,
+    'api.openweathermap.org': 50,
+}
+
+
+def daily_readings(forecast: list) -> list:
+    '''
+    Keeps one reading out of eight (one a day) of each city, the resolution of
+    the weather table.\n
+    Args:
+        forecast (list): 3 hourly readings, in time order for each city.
+    Returns:
+        list: The kept readings.
+    '''
+    positions = {}
+    kept = []
+    for reading in forecast:
+        position = positions.get(reading['city'], 0)
+        positions[reading['city']] = position + 1
+        if position % 8 == 0:
+            kept.append(reading)
+    return kept
+
+
+class RateLimiter:
+    '''
+    Thread-safe per-host rate limiter spacing out requests to the same host.\n
+    Args:
+        rates (dict): Maximum number of requests per second, keyed by host.
+    '''
+
+    def __init__(self, rates: dict):
+        self.rates = rates
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url: str) -> None:
+        '''
+        Blocks until a request to the host of url is allowed.\n
+        Args:
+            url (str): The url about to be requested.
+        '''
+        host = urlparse(url).netloc
+        rate = self.rates.get(host)
+        if not rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
 
 class WeatherCall:
-    def __init__(self, cities):
+    def __init__(self, cities, max_workers: int = 8, rate_limits: dict = None,
+                 geocache: GeocodeCache = None, fetch: bool = True):
+        '''
+        Args:
+            cities (list): The cities to retrieve the weather of.
+            max_workers (int, optional): Number of concurrent API calls.
+            rate_limits (dict, optional): Requests per second keyed by host.
+            geocache (GeocodeCache, optional): Cache of the city coordinates.
+            fetch (bool, optional): Retrieve the weather right away, otherwise
+                self.weather stays None until get_cities_weather is called.
+        '''
+        self.forecast = None
         self.cities = cities
+        self.geocache = geocache
         self.apikey = os.getenv('APIKEY')
-        self.aws = AwsInstance()
-        self.weather = self.get_cities_weather()
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(rate_limits or DEFAULT_RATE_LIMITS)
+        self.session = self._get_session()
+        self.weather = self.get_cities_weather() if fetch else None
+
+    def _get_session(self):
+        '''
+        Creates a requests session with a connection pool sized for the workers.\n
+        Returns:
+            requests.Session: Session shared by all API calls.
+        '''
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.limiter.rates) or 1,
+                              pool_maxsize=self.max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['User-Agent'] = 'kayak-project'
+        return session
+
+    def _request(self, url: str, params: dict):
+        '''
+        Sends a GET request through the shared session, respecting host rate limits.\n
+        Args:
+            url (str): The url to request.
+            params (dict): Query string parameters.
+        Returns:
+            requests.Response: The API response.
+        '''
+        self.limiter.wait(url)
+        host = urlparse(url).netloc
+        start = time.perf_counter()
+        response = self.session.get(url, params=params, timeout=30)
+        metrics.observe('api_request', time.perf_counter() - start, host=host)
+        metrics.count('api_requests', host=host, status=response.status_code)
+        metrics.count('api_bytes', len(response.content), host=host)
+        return response
 
     def _get_geo(self, city: str):
         '''
         Retrieves the latitude and longitude coordinates of a city using the Nominatim API.\n
+        Coordinates found in the geocode cache are returned without any request.\n
         Args:
             city (str): Name of the city.
         Returns:
             tuple: A tuple containing latitude and longitude coordinates of the city.
         '''
-        url = 'https://nominatim.openstreetmap.org/search?'
+        if self.geocache is not None:
+            cached = self.geocache.get(city)
+            if cached is not None:
+                return cached
+        url = f'{NOMINATIM_URL}/search?'
         params = {
             'city': city,
             'format': 'json'
         }
-        response = requests.get(url, params=params)
+        response = self._request(url, params)
         if response.status_code == 200:
             content = response.json()
             lat, lon = content[0]['lat'], content[0]['lon']
+            if self.geocache is not None:
+                self.geocache.set(city, lat, lon)
             return (lat, lon)
         raise Exception
 
@@ -43,9 +161,9 @@ class WeatherCall:
             lat (float): Latitude coordinate of the city.
             lon (float): Longitude coordinate of the city.
         Returns:
-            list: List containing weather information for the specified city.
+            list: List containing every 3 hourly reading of the city.
         '''
-        url = 'https://api.openweathermap.org/data/2.5/forecast?'
+        url = f'{OPENWEATHER_URL}/data/2.5/forecast?'
         params = {
             'lat': lat,
             'lon': lon,
@@ -53,43 +171,113 @@ class WeatherCall:
             'units': 'metric'
         }
 
-        response = requests.get(url, params=params)
+        response = self._request(url, params)
         content = response.json()
         sunrise = content['city']['sunrise']
         sunset = content['city']['sunset']
         weather = []
-        for i, id in enumerate(content['list']):
-            if i % 8 == 0:
-                weather.append({
-                    'city': city,
-                    'weather': id['weather'][0]['main'],
-                    'temps': id['main']['temp'],
-                    'feels_like': id['main']['feels_like'],
-                    'sunrise': sunrise,
-                    'sunset': sunset,
-                    'dt_text': id['dt_txt']
-                })
+        for id in content['list']:
+            weather.append({
+                'city': city,
+                'weather': id['weather'][0]['main'],
+                'temps': id['main']['temp'],
+                'feels_like': id['main']['feels_like'],
+                'sunrise': sunrise,
+                'sunset': sunset,
+                'dt_text': id['dt_txt']
+            })
         return weather
 
-    def get_cities_weather(self):
+    def _get_city_weather(self, city: str, coordinates: dict = None):
         '''
-        Retrieves weather information for all specified cities.\n
+        Geocodes a city then retrieves its weather information.\n
+        Args:
+            city (str): Name of the city.
+            coordinates (dict, optional): Coordinates already resolved, keyed by city.
         Returns:
-            list: List containing weather information for all specified cities.
+            list: List containing weather information for the city.
+        '''
+        if coordinates and city in coordinates:
+            lat, lon = coordinates[city]
+        else:
+            lat, lon = self._get_geo(city)
+        return self._get_weather(city, lat, lon)
+
+    def geocode(self) -> dict:
+        '''
+        Resolves the coordinates of all specified cities concurrently.\n
+        Returns:
+            dict: Latitude and longitude tuples keyed by city.
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(self.cities, executor.map(self._get_geo, self.cities)))
+
+    def get_cities_forecast(self, coordinates: dict = None):
+        '''
+        Retrieves the full 3 hourly forecast of all specified cities.\n
+        Cities are fetched concurrently by up to max_workers threads, results
+        keep the order of self.cities.\n
+        Args:
+            coordinates (dict, optional): Coordinates returned by geocode, cities
+                missing from it are geocoded on the way.
+        Returns:
+            list: List containing every reading of all specified cities.
         '''
         logging.info('Starting Weather API calls')
-        geocode = geocode = {city: self._get_geo(city) for city in self.cities}
-        weather = []
-        for k, v in geocode.items():
-            weather.extend(self._get_weather(k, v[0], v[1]))
-        return weather
+        forecast = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for city_forecast in executor.map(
+                lambda city: self._get_city_weather(city, coordinates), self.cities
+            ):
+                forecast.extend(city_forecast)
+        return forecast
+
+    def get_cities_weather(self, coordinates: dict = None):
+        '''
+        Retrieves weather information for all specified cities, one reading a
+        day. The full forecast of the same calls is kept in self.forecast.\n
+        Args:
+            coordinates (dict, optional): Coordinates returned by geocode.
+        Returns:
+            list: List containing weather information for all specified cities.
+        '''
+        self.forecast = self.get_cities_forecast(coordinates)
+        return daily_readings(self.forecast)
 
-    def to_s3(self):
+    def save(self, file_path: str = 'weather.json') -> str:
         '''
-        Stores weather information into a JSON file and uploads it to AWS S3.
+        Stores weather information into a JSON file.\n
+        Args:
+            file_path (str, optional): Path of the JSON file.
+        Returns:
+            str: Path of the written file.
         '''
-        file_path = 'weather.json'
         with open(file_path, "w", encoding='utf-8') as json_file:
             json.dump(self.weather, json_file, indent=4)
+        return file_path
 
-        self.aws.push_to_s3('weather.json')
+    def save_forecast(self, file_path: str = 'weather_forecast.json') -> str:
+        '''
+        Stores the full resolution forecast into a JSON file.\n
+        Args:
+            file_path (str, optional): Path of the JSON file.
+        Returns:
+            str: Path of the written file.
+        '''
+        with open(file_path, "w", encoding='utf-8') as json_file:
+            json.dump(self.forecast, json_file)
+        return file_path
+
+    def to_s3(self, compression: str = None, forecast: bool = False):
+        '''
+        Stores weather information into a JSON file and uploads it to AWS S3.\n
+        Args:
+            compression (str, optional): "gzip" or "zstd" to compress the upload.
+            forecast (bool, optional): Also store and upload the full resolution
+                forecast. Defaults to False.
+        '''
+        file_path = self.save('weather.json')
+        aws = get_aws()
+        aws.push_to_s3(file_path, compression=compression)
+        if forecast:
+            aws.push_to_s3(self.save_forecast(), compression=compression)
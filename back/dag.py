@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from metrics import metrics
+
+
+class Stage:
+    """
+    A step of the pipeline.\n
+    Args:
+        name (str): Unique name of the stage.
+        func (callable): Work of the stage, called with the results of its
+            dependencies as keyword arguments named after them.
+        deps (list): Names of the stages whose results are needed.
+        retries (int): Extra attempts after a failure.
+        retry_delay (float): Seconds before the first retry, doubled at each attempt.
+    """
+
+    def __init__(self, name: str, func, deps: list, retries: int, retry_delay: float):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+
+class Dag:
+    """
+    Runs pipeline stages as soon as the stages they depend on are done.
+
+    Independent stages run concurrently on a thread pool, so the wall time of
+    a run is the one of its longest chain of stages. A failed stage is retried,
+    and when it runs out of attempts the stages downstream of it are skipped
+    while the other branches go on.
+    The duration of each stage is kept in a JSON file to estimate the critical
+    path of the next runs.
+    """
+
+    def __init__(self, workers: int = 4, timings_path: str = "dag_timings.json"):
+        self.workers = workers
+        self.timings_path = timings_path
+        self.stages = {}
+
+    def add(self, name: str, func, deps: list = (), retries: int = 0,
+            retry_delay: float = 5.0) -> None:
+        """
+        Declares a stage, see Stage for the arguments.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already declared")
+        self.stages[name] = Stage(name, func, deps, retries, retry_delay)
+
+    def select(self, names: list) -> "Dag":
+        """
+        Keeps a part of the pipeline, dependencies on the stages left out are
+        dropped so the kept stages run on what a previous run left on disk.\n
+        Args:
+            names (list): Stages to keep, unknown names are ignored.
+        Returns:
+            Dag: A new pipeline with the kept stages.
+        """
+        dag = Dag(self.workers, self.timings_path)
+        for name, stage in self.stages.items():
+            if name in names:
+                deps = [dep for dep in stage.deps if dep in names]
+                dag.stages[name] = Stage(name, stage.func, deps, stage.retries,
+                                         stage.retry_delay)
+        return dag
+
+    def order(self) -> list:
+        """
+        Sorts the stages so each one comes after its dependencies.\n
+        Returns:
+            list: Stage names in execution order.
+        """
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        order = []
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items()
+                     if all(dep not in remaining for dep in stage.deps)]
+            if not ready:
+                raise ValueError(f"Dependency cycle between {', '.join(remaining)}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+        return order
+
+    def _load_timings(self) -> dict:
+        if not os.path.exists(self.timings_path):
+            return {}
+        with open(self.timings_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_timings(self, durations: dict) -> None:
+        timings = self._load_timings()
+        timings.update(durations)
+        with open(self.timings_path, "w", encoding="utf-8") as file:
+            json.dump(timings, file, indent=4)
+
+    def critical_path(self, durations: dict) -> tuple:
+        """
+        Finds the longest chain of stages.\n
+        Args:
+            durations (dict): Seconds per stage, stages missing count for 1 second.
+        Returns:
+            tuple: Stage names of the chain and its total duration.
+        """
+        finish = {}
+        previous = {}
+        for name in self.order():
+            deps = self.stages[name].deps
+            start_after = max(deps, key=lambda dep: finish[dep]) if deps else None
+            previous[name] = start_after
+            finish[name] = (finish[start_after] if start_after else 0) + durations.get(name, 1.0)
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+    def dry_run(self) -> tuple:
+        """
+        Prints the stages in execution order and the critical path, estimated
+        from the durations of the previous runs, without running anything.\n
+        Returns:
+            tuple: Stage names of the critical path and its estimated duration.
+        """
+        timings = self._load_timings()
+        for name in self.order():
+            stage = self.stages[name]
+            estimate = f"{timings[name]:.1f}s" if name in timings else "unknown"
+            deps = ", ".join(stage.deps) or "-"
+            print(f"{name:<16} after: {deps:<32} retries: {stage.retries}  last: {estimate}")
+        path, total = self.critical_path(timings)
+        print(f"Critical path: {' -> '.join(path)} ({total:.1f}s)")
+        return path, total
+
+    def _run_stage(self, stage: Stage, kwargs: dict) -> tuple:
+        """
+        Runs a stage, retrying it with an exponential backoff.\n
+        Returns:
+            tuple: Result of the stage and duration of the successful attempt.
+        """
+        for attempt in range(stage.retries + 1):
+            start = time.perf_counter()
+            try:
+                with metrics.timer("stage", stage=stage.name):
+                    result = stage.func(**kwargs)
+            except Exception:
+                metrics.count("stage_failures", stage=stage.name)
+                if attempt == stage.retries:
+                    raise
+                delay = stage.retry_delay * 2 ** attempt
+                logging.exception(f"Stage {stage.name} failed")
+                print(f"Retrying {stage.name} in {delay:.0f}s "
+                      f"({attempt + 1}/{stage.retries})")
+                time.sleep(delay)
+            else:
+                return result, time.perf_counter() - start
+
+    def run(self, dry_run: bool = False) -> dict:
+        """
+        Runs every stage.\n
+        Args:
+            dry_run (bool, optional): Only print the critical path. Defaults to False.
+        Returns:
+            dict: Result of each stage keyed by name.
+        Raises:
+            RuntimeError: When a stage failed, after the other branches completed.
+        """
+        if dry_run:
+            self.dry_run()
+            return {}
+        waiting = self.order()
+        results = {}
+        durations = {}
+        failed = set()
+        running = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while waiting or running:
+                for name in list(waiting):
+                    deps = self.stages[name].deps
+                    if any(dep in failed for dep in deps):
+                        print(f"Skipping {name}, an upstream stage failed")
+                        failed.add(name)
+                        waiting.remove(name)
+                    elif all(dep in results for dep in deps):
+                        kwargs = {dep: results[dep] for dep in deps}
+                        running[executor.submit(self._run_stage, self.stages[name], kwargs)] = name
+                        waiting.remove(name)
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name], durations[name] = future.result()
+                        print(f"Stage {name} done in {durations[name]:.1f}s")
+                    except Exception:
+                        logging.exception(f"Stage {name} failed")
+                        print(f"Stage {name} failed")
+                        failed.add(name)
+        elapsed = time.perf_counter() - start
+        self._save_timings(durations)
+        print(f"Pipeline done in {elapsed:.1f}s, "
+              f"{sum(durations.values()):.1f}s of stage time")
+        if failed:
+            raise RuntimeError(f"Failed or skipped stages: {', '.join(sorted(failed))}")
+        return results
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Time
+from sqlalchemy import (Column, Integer, BigInteger, String, Float, Date, DateTime, Time, Index,
+                        UniqueConstraint, text)
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -10,6 +11,11 @@ class HotelsTable(Base):
     """
 
     __tablename__ = "hotels"
+    __table_args__ = (
+        # lookups by name are served by the primary key
+        Index("hotels_city_idx", "city", "dt_partition"),
+        {"postgresql_partition_by": "RANGE (dt_partition)"},
+    )
 
     name = Column(String, primary_key=True)
     city = Column(String)
@@ -26,7 +32,77 @@ class HotelsTable(Base):
     wifi = Column(Float)
     lat = Column(Float)
     lon = Column(Float)
-    dt_partition = Column(String, primary_key=True)
+    dt_partition = Column(Date, primary_key=True)
+
+
+class HotelDimTable(Base):
+    """
+    Static attributes of the hotels, one row per hotel, a hotel being a name
+    in a city
+    """
+
+    __tablename__ = "hotel_dim"
+    __table_args__ = (
+        UniqueConstraint("name", "city", name="hotel_dim_name_city_key"),
+        Index("hotel_dim_city_idx", "city"),
+    )
+
+    hotel_id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    city = Column(String, nullable=False)
+    description = Column(String)
+    url = Column(String)
+    lat = Column(Float)
+    lon = Column(Float)
+
+
+class HotelDailyTable(Base):
+    """
+    Daily ratings and reviews of the hotels, keyed by hotel_dim.hotel_id
+    """
+
+    __tablename__ = "hotel_daily"
+    __table_args__ = ({"postgresql_partition_by": "RANGE (dt_partition)"},)
+
+    hotel_id = Column(Integer, primary_key=True, autoincrement=False)
+    rating = Column(Float)
+    reviews = Column(Integer)
+    personnel = Column(Float)
+    equipments = Column(Float)
+    property = Column(Float)
+    comfort = Column(Float)
+    value = Column(Float)
+    location = Column(Float)
+    wifi = Column(Float)
+    dt_partition = Column(Date, primary_key=True)
+
+
+class HotelScoresTable(Base):
+    """
+    Versions of the hotels ratings and reviews, each one valid from valid_from
+    until valid_to excluded, the current one has no valid_to
+    """
+
+    __tablename__ = "hotel_scores"
+    __table_args__ = (
+        Index("hotel_scores_current_idx", "hotel_id", unique=True,
+              postgresql_where=text("valid_to IS NULL"),
+              sqlite_where=text("valid_to IS NULL")),
+    )
+
+    hotel_id = Column(Integer, primary_key=True, autoincrement=False)
+    valid_from = Column(Date, primary_key=True)
+    valid_to = Column(Date)
+    row_hash = Column(BigInteger)
+    rating = Column(Float)
+    reviews = Column(Integer)
+    personnel = Column(Float)
+    equipments = Column(Float)
+    property = Column(Float)
+    comfort = Column(Float)
+    value = Column(Float)
+    location = Column(Float)
+    wifi = Column(Float)
 
 
 class WeatherTable(Base):
@@ -35,6 +111,11 @@ class WeatherTable(Base):
     """
 
     __tablename__ = "weather"
+    __table_args__ = (
+        Index("weather_city_idx", "city", "dt_partition"),
+        Index("weather_dt_text_idx", "dt_text", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (dt_partition)"},
+    )
 
     city = Column(String, primary_key=True)
     weather = Column(String)
@@ -44,4 +125,88 @@ class WeatherTable(Base):
     sunset = Column(DateTime)
     dt_text = Column(DateTime, primary_key=True)
     daylight = Column(Integer)
-    dt_partition = Column(String, primary_key=True)
+    dt_partition = Column(Date, primary_key=True)
+
+
+class WeatherForecastTable(Base):
+    """
+    Weather forecast at full resolution, one row per 3 hour reading
+    """
+
+    __tablename__ = "weather_forecast"
+    __table_args__ = (
+        Index("weather_forecast_city_idx", "city", "dt_partition"),
+        Index("weather_forecast_dt_text_idx", "dt_text", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (dt_partition)"},
+    )
+
+    city = Column(String, primary_key=True)
+    weather = Column(String)
+    temps = Column(Float)
+    feels_like = Column(Float)
+    sunrise = Column(DateTime)
+    sunset = Column(DateTime)
+    dt_text = Column(DateTime, primary_key=True)
+    daylight = Column(Integer)
+    dt_partition = Column(Date, primary_key=True)
+
+
+class EtlStateTable(Base):
+    """
+    Source files already loaded by the ETL
+    """
+
+    __tablename__ = "etl_state"
+
+    source = Column(String, primary_key=True)
+    checksum = Column(String, primary_key=True)
+    dt_partition = Column(String)
+    rows = Column(Integer)
+    loaded_at = Column(DateTime)
+
+
+class CityRatingDaily(Base):
+    """
+    Hotels ratings and reviews rolled up per day and city
+    """
+
+    __tablename__ = "city_rating_daily"
+
+    dt_partition = Column(Date, primary_key=True)
+    city = Column(String, primary_key=True)
+    rating_sum = Column(Float)
+    rating_count = Column(Integer)
+    reviews_sum = Column(Integer)
+    hotels = Column(Integer)
+    lat = Column(Float)
+    lon = Column(Float)
+
+
+class WeatherCityDaily(Base):
+    """
+    Weather forecasts rolled up per day and city
+    """
+
+    __tablename__ = "weather_city_daily"
+
+    dt_partition = Column(Date, primary_key=True)
+    city = Column(String, primary_key=True)
+    temps = Column(Float)
+    feels_like = Column(Float)
+
+
+class WeatherForecastDaily(Base):
+    """
+    Forecast temperatures rolled up per forecast day and city
+    """
+
+    __tablename__ = "weather_forecast_daily"
+
+    dt_partition = Column(Date, primary_key=True)
+    city = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    temps_min = Column(Float)
+    temps_max = Column(Float)
+    temps_mean = Column(Float)
+    feels_like_mean = Column(Float)
+    readings = Column(Integer)
@@ -0,0 +1,76 @@
+import pandas as pd
+from sqlalchemy import bindparam, text
+from data_models import Base
+from loader import BulkLoader
+
+# static attributes stored once per hotel, and the columns stored each day
+DIM_COLUMNS = [col.name for col in Base.metadata.tables["hotel_dim"].columns
+               if col.name != "hotel_id"]
+FACT_COLUMNS = [col.name for col in Base.metadata.tables["hotel_daily"].columns]
+# hotels sharing a name in different cities are different hotels
+DIM_KEYS = ["name", "city"]
+
+
+def read_dim(connection, cities: list = None) -> pd.DataFrame:
+    """
+    Reads the hotel_dim rows of the given cities, or the whole table.
+    """
+    query = f"SELECT hotel_id, {', '.join(DIM_COLUMNS)} FROM hotel_dim"
+    if cities is None:
+        return pd.read_sql(text(query), connection)
+    query = text(f"{query} WHERE city IN :cities").bindparams(
+        bindparam("cities", expanding=True)
+    )
+    return pd.read_sql(query, connection, params={"cities": cities})
+
+
+def _upsert_rows(connection, dim: pd.DataFrame) -> None:
+    """
+    Inserts the new hotels and updates the changed ones with plain statements,
+    for databases without COPY.
+    """
+    stored = read_dim(connection).set_index(DIM_KEYS)
+    known = dim.set_index(DIM_KEYS).index.isin(stored.index)
+    dim[~known].to_sql("hotel_dim", con=connection, if_exists="append", index=False)
+    current = dim[known].set_index(DIM_KEYS)
+    stored = stored.loc[current.index, current.columns]
+    same = (current == stored) | (current.isna() & stored.isna())
+    changed = current[~same.all(axis=1)].reset_index()
+    if changed.empty:
+        return
+    changed = changed.astype(object).where(changed.notna(), None)
+    updates = ", ".join(f"{col} = :{col}" for col in DIM_COLUMNS if col not in DIM_KEYS)
+    connection.execute(
+        text(f"UPDATE hotel_dim SET {updates} WHERE name = :name AND city = :city"),
+        changed.to_dict("records"),
+    )
+
+
+def split_hotels(connection, hotels: pd.DataFrame, load_mode: str = "copy",
+                 batch_size: int = 50000) -> pd.DataFrame:
+    """
+    Splits cleaned hotels between the dimension and the daily fact table.\n
+    The static attributes are upserted into hotel_dim, keyed by the hotel
+    name and city. A new hotel gets its surrogate hotel_id there, an existing
+    one only has its row rewritten when an attribute changed. Rows without a
+    city cannot be keyed and are left out.\n
+    Args:
+        connection (sqlalchemy.Connection): Connection of the load transaction.
+        hotels (pd.DataFrame): Hotels matching the HotelsTable schema.
+        load_mode (str, optional): "copy" or "insert", as in Kayak.
+            Defaults to "copy".
+        batch_size (int, optional): Rows per COPY batch. Defaults to 50000.
+    Returns:
+        pd.DataFrame: The daily rows matching the HotelDailyTable schema.
+    """
+    hotels = hotels.dropna(subset=DIM_KEYS)
+    dim = hotels[DIM_COLUMNS].drop_duplicates(subset=DIM_KEYS, keep="last")
+    if load_mode == "copy":
+        BulkLoader(batch_size).load(connection, dim, "hotel_dim", keys=DIM_KEYS)
+    else:
+        _upsert_rows(connection, dim)
+    ids = read_dim(connection, dim["city"].unique().tolist())
+    facts = hotels.merge(ids[["hotel_id", *DIM_KEYS]], on=DIM_KEYS, how="inner")
+    return facts[FACT_COLUMNS].drop_duplicates(
+        subset=["hotel_id", "dt_partition"], keep="last"
+    )
@@ -1,19 +1,156 @@
 import os
-import sys
+import hashlib
 import datetime
 import pandas as pd
-from sqlalchemy import create_engine, inspect
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.exc import OperationalError
 from data_models import Base
+from loader import BulkLoader
+from lake import table_schema
+from schema import SchemaManager
+from metrics import metrics
+from snapshot import write_snapshot
+from dimension import split_hotels
+from history import close_missing, load_changes
+import rollups
+
+
+DEFAULT_SOURCES = {"weather": "weather.json", "hotels": "bookings_hotels.json"}
+
+SUBSCORES = {
+    "Personnel": "personnel",
+    "Équipements": "equipments",
+    "Propreté": "property",
+    "Confort": "comfort",
+    "Rapport qualité/prix": "value",
+    "Situation géographique": "location",
+    "Connexion Wi-Fi gratuite": "wifi",
+}
+
+
+def is_json_lines(filepath: str) -> bool:
+    """
+    Tells whether a feed file is JSON Lines, compressed or not.
+    """
+    return ".jsonl" in os.path.basename(filepath)
+
+
+def clean_weather(weather: pd.DataFrame, dt_partition: str) -> pd.DataFrame:
+    """
+    Cleans raw weather records returned by WeatherCall.\n
+    Args:
+        weather (pd.DataFrame): Raw weather records.
+        dt_partition (str): Partition date of the rows.
+    Returns:
+        pd.DataFrame: Weather matching the WeatherTable schema.
+    """
+    weather["daylight"] = (weather["sunset"] - weather["sunrise"]) // 3600
+    weather["sunrise"] = pd.to_datetime(weather["sunrise"], unit="s")
+    weather["sunset"] = pd.to_datetime(weather["sunset"], unit="s")
+    weather["dt_partition"] = dt_partition
+    return weather
+
+
+def _arrow_strings(series: pd.Series) -> pa.Array:
+    return pa.array(series, type=pa.string(), from_pandas=True)
+
+
+def _french_float(series: pd.Series) -> pd.Series:
+    """
+    Parses decimal comma strings ("8,5") to floats, missing values become NaN.
+    """
+    if series.dtype != object:
+        return pd.to_numeric(series, errors="coerce")
+    dotted = pc.replace_substring(_arrow_strings(series), ",", ".")
+    try:
+        values = pc.cast(dotted, pa.float64()).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        values = pd.to_numeric(dotted.to_pandas(), errors="coerce")
+    return pd.Series(values, index=series.index)
+
+
+def clean_hotels(hotels: pd.DataFrame, dt_partition: str) -> pd.DataFrame:
+    """
+    Cleans raw scraped hotels with vectorized Arrow string kernels.\n
+    Args:
+        hotels (pd.DataFrame): Raw items yielded by HotelSpider.
+        dt_partition (str): Partition date of the rows.
+    Returns:
+        pd.DataFrame: Hotels matching the HotelsTable schema.
+    """
+    hotels = hotels.rename(SUBSCORES, axis=1)
+    # "1 234 expériences vécues" -> 1234
+    reviews = pc.replace_substring_regex(
+        _arrow_strings(hotels["reviews"]), r"( [^ ]*){2}$", ""
+    )
+    reviews = pc.cast(pc.replace_substring(reviews, " ", ""), pa.int64())
+    hotels["reviews"] = reviews.to_numpy(zero_copy_only=False)
+    coordinates = pc.split_pattern(_arrow_strings(hotels["coordinates"]), ",")
+    for i, col in enumerate(["lat", "lon"]):
+        coordinate = pc.cast(pc.list_element(coordinates, i), pa.float64())
+        hotels[col] = coordinate.to_numpy(zero_copy_only=False)
+    hotels.drop("coordinates", axis=1, inplace=True)
+    for col in SUBSCORES.values():
+        # a chunk may hold no hotel rated on a category
+        if col not in hotels:
+            hotels[col] = float("nan")
+        hotels[col] = _french_float(hotels[col])
+    hotels["rating"] = _french_float(hotels["rating"])
+    hotels["dt_partition"] = dt_partition
+    return hotels
 
 
 class Kayak:
-    def __init__(self, tables: dict):
+    def __init__(self, tables: dict, sources: dict = None, load_mode: str = "copy",
+                 batch_size: int = 50000, chunksize: int = None, lake=None,
+                 retention_days: int = None, snapshot_dir: str = None,
+                 hotels_storage: str = "wide", full_crawl: bool = True, run: bool = True,
+                 setup: bool = True):
         self.tables = tables
+        self.lake = lake
+        self.sources = sources or DEFAULT_SOURCES
+        self.batch_size = batch_size
+        self.chunksize = chunksize
+        self.snapshot_dir = snapshot_dir
+        # "normalized" splits hotels into hotel_dim and hotel_daily behind a hotels
+        # view, "changes" keeps only the changed scores in hotel_scores instead
+        self.hotels_storage = hotels_storage
+        # a full crawl lists every hotel of its cities, the change-only history
+        # closes the hotels missing from it, an incremental crawl does not
+        if not full_crawl and hotels_storage != "changes":
+            # the other storages need a row of every hotel on every day
+            raise ValueError("Incremental crawls skip unchanged hotels, "
+                             "they need the 'changes' hotels storage")
+        self.full_crawl = full_crawl
         self.engine = self._postgres_connection()
-        self._create_table()
-        self.weather_df = self.transfrom_weather()
-        self.hotels_df = self.transform_hotels()
+        # COPY is PostgreSQL only, other databases fall back to plain inserts
+        if self.engine.dialect.name != "postgresql":
+            load_mode = "insert"
+        self.load_mode = load_mode
+        self.schema = SchemaManager(self.engine, retention_days)
+        # without setup, the tables were created by another instance, such as the
+        # one of the database stage before the crawl processes load into them
+        if setup:
+            # migrations and switching storages are run by python schema.py
+            self.schema.check_migrated()
+            self.schema.check_hotels_storage(hotels_storage)
+            self._create_table()
+            if hotels_storage != "wide":
+                self.schema.create_hotels_view(hotels_storage)
+            # the front and the changes storage read the days from the rollups
+            rollups.rebuild(self.engine, only_empty=True)
+        self.weather_df = None
+        self.forecast_df = None
+        self.hotels_df = None
+        # without run, the caller schedules the transforms itself
+        if run:
+            self.weather_df = self.transfrom_weather()
+            self.forecast_df = self.transform_forecast()
+            self.hotels_df = self.transform_hotels()
+            self.schema.apply_retention()
+            self.write_snapshot()
 
     def _create_table(self):
         inspector = inspect(self.engine)
@@ -21,7 +158,7 @@ class Kayak:
         created_tables = inspector.get_table_names()
         for table in self.tables:
             if table not in created_tables:
-                Base.metadata.create_all(self.engine)
+                Base.metadata.create_all(self.engine, tables=[Base.metadata.tables[table]])
                 print(f"Create table {table}")
 
     def _postgres_connection(self):
@@ -33,57 +170,257 @@ class Kayak:
                 return engine
         except OperationalError as ex:
             print(f"Sorry failed to connect: {ex}")
-            sys.exit()
+            # raised, not exited, so the database stage is retried then fails the run
+            raise
 
-    def transfrom_weather(self):
-        weather = pd.read_json("weather.json")
-        weather["daylight"] = (weather["sunset"] - weather["sunrise"]) // 3600
-        weather["sunrise"] = pd.to_datetime(weather["sunrise"], unit="s")
-        weather["sunset"] = pd.to_datetime(weather["sunset"], unit="s")
-        weather["dt_partition"] = datetime.date.today().strftime("%Y-%m-%d")
-        weather.to_sql("weather", con=self.engine,
-                       if_exists="append", index=False)
-        print(f"Inserted {weather.shape[0]} in Weather table")
-        return weather
+    @staticmethod
+    def _checksum(filepath: str) -> str:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
-    def transform_hotels(self):
-        def get_float(x):
-            try:
-                return float(x.replace(",", "."))
-            except AttributeError:
-                return x
-            except ValueError:
-                return x
-
-        hotels = pd.read_json("bookings_hotels.json")
-        mapper = {
-            "Personnel": "personnel",
-            "Équipements": "equipments",
-            "Propreté": "property",
-            "Confort": "comfort",
-            "Rapport qualité/prix": "value",
-            "Situation géographique": "location",
-            "Connexion Wi-Fi gratuite": "wifi",
-        }
-        hotels.rename(mapper, axis=1, inplace=True)
-        hotels["reviews"] = hotels["reviews"].apply(
-            lambda x: int("".join(x.split(" ")[:-2]))
+    def _is_loaded(self, connection, source: tuple) -> bool:
+        query = text(
+            "SELECT 1 FROM etl_state WHERE source = :source AND checksum = :checksum"
         )
-        hotels["lat"] = (
-            hotels["coordinates"].apply(
-                lambda x: x.split(",")[0]).astype(float)
+        name, checksum = source
+        return connection.execute(
+            query, {"source": name, "checksum": checksum}
+        ).first() is not None
+
+    def _pending_source(self, key: str):
+        """
+        Checks whether the input file of a dataset still has to be processed.\n
+        Args:
+            key (str): Dataset name in self.sources.
+        Returns:
+            tuple: (file name, checksum) of the input, or None when the file is
+            missing or this exact content was already loaded.
+        """
+        filepath = self.sources[key]
+        if not os.path.exists(filepath):
+            print(f"No {filepath} to process")
+            return None
+        source = (os.path.basename(filepath), self._checksum(filepath))
+        with self.engine.connect() as connection:
+            if self._is_loaded(connection, source):
+                print(f"Skipping {filepath}, already loaded")
+                return None
+        return source
+
+    def _read_chunks(self, key: str):
+        """
+        Reads the input file of a dataset.\n
+        JSON Lines inputs (.jsonl, optionally compressed) are streamed in
+        frames of at most self.chunksize rows when chunksize is set, any
+        other input is read whole.\n
+        Args:
+            key (str): Dataset name in self.sources.
+        Yields:
+            pd.DataFrame: Raw rows of the input.
+        """
+        filepath = self.sources[key]
+        lines = is_json_lines(filepath)
+        if lines and self.chunksize:
+            with pd.read_json(filepath, lines=True, chunksize=self.chunksize) as reader:
+                yield from reader
+        else:
+            yield pd.read_json(filepath, lines=lines)
+
+    def _clean_chunks(self, key: str, clean, dt_partition: str):
+        """
+        Reads and cleans the input of a dataset chunk by chunk.\n
+        When a data lake is set, the raw and cleaned chunks are also written to
+        its raw/<key> and <key> Parquet datasets. The day is cleared from both
+        first, so a re-run does not keep the cities of a previous one.\n
+        Args:
+            key (str): Dataset name in self.sources, also the target table.
+            clean (callable): Cleaning function taking a chunk and dt_partition.
+            dt_partition (str): Partition date of the rows.
+        Yields:
+            pd.DataFrame: Cleaned rows.
+        """
+        if self.lake is not None:
+            for dataset in (f"raw/{key}", key):
+                self.lake.clear(dataset, dt_partition)
+        for chunk in self._read_chunks(key):
+            metrics.count("rows_read", chunk.shape[0], table=key)
+            if self.lake is not None:
+                with metrics.timer("lake_write", dataset=f"raw/{key}"):
+                    raw = chunk.assign(dt_partition=dt_partition)
+                    self.lake.write(raw, f"raw/{key}", append=True)
+            with metrics.timer("transform", table=key):
+                cleaned = clean(chunk, dt_partition)
+            if self.lake is not None:
+                with metrics.timer("lake_write", dataset=key):
+                    self.lake.write(cleaned, key, schema=table_schema(key), append=True)
+            yield cleaned
+
+    def _load(self, frames, table: str, source: tuple = None, lock: str = None,
+              complete: bool = False):
+        """
+        Writes DataFrames into a table in a single transaction.\n
+        The rollups of the loaded partitions are refreshed in the same
+        transaction. When a source is given, it is recorded in etl_state too,
+        and the load is skipped if a concurrent run already recorded it.\n
+        Args:
+            frames (iterable): DataFrames to write, consumed one at a time.
+            table (str): Name of the target table.
+            source (tuple, optional): (file name, checksum) of the input file.
+            lock (str, optional): Name serializing loads without source, such as
+                the batches of concurrent crawl shards. Defaults to the source.
+            complete (bool, optional): The frames hold every hotel of their cities,
+                the missing ones are closed in the change-only history.
+        Returns:
+            pd.DataFrame: The loaded rows, or None when the load was skipped or
+            ran in chunked mode.
+        """
+        loaded = []
+        listed = []
+        rows = 0
+        partitions = set()
+        changes = table == "hotels" and self.hotels_storage == "changes"
+        if source is not None:
+            lock = source[0]
+        with self.engine.begin() as connection:
+            if lock is not None and self.engine.dialect.name == "postgresql":
+                connection.execute(
+                    text("SELECT pg_advisory_xact_lock(hashtext(:lock))"), {"lock": lock}
+                )
+            if source is not None:
+                if self._is_loaded(connection, source):
+                    print(f"Skipping {source[0]}, loaded by another run")
+                    return None
+            for df in frames:
+                with metrics.timer("load", table=table, mode=self.load_mode):
+                    if table == "hotels" and self.hotels_storage != "wide":
+                        facts = split_hotels(connection, df, self.load_mode, self.batch_size)
+                        if changes:
+                            load_changes(connection, facts, self.load_mode, self.batch_size)
+                            listed.append(df[["name", "city", "dt_partition"]])
+                        else:
+                            self._write(connection, facts, "hotel_daily")
+                    else:
+                        self._write(connection, df, table)
+                metrics.count("rows_loaded", df.shape[0], table=table)
+                rows += df.shape[0]
+                partitions.update(map(str, df["dt_partition"].unique()))
+                if not self.chunksize:
+                    loaded.append(df)
+            if complete and listed:
+                self._close_missing(connection, pd.concat(listed))
+            with metrics.timer("rollups", table=table):
+                # the hotels view of the change-only history is built on the rollup
+                rollups.refresh(connection, "hotel_scores" if changes else table, partitions)
+            if source is not None:
+                self._record_source(connection, source, partitions, rows)
+        if changes:
+            print(f"Compared {rows} hotels with their versions in hotel_scores")
+        else:
+            print(f"Inserted {rows} in {table.capitalize()} table")
+        return pd.concat(loaded) if loaded else None
+
+    def _write(self, connection, df: pd.DataFrame, table: str) -> None:
+        self.schema.ensure_partitions(connection, table, df["dt_partition"].unique())
+        if self.load_mode == "copy":
+            BulkLoader(self.batch_size).load(connection, df, table)
+        else:
+            df.to_sql(table, con=connection, if_exists="append", index=False)
+
+    def _record_source(self, connection, source: tuple, partitions: set, rows: int) -> None:
+        query = text(
+            "INSERT INTO etl_state (source, checksum, dt_partition, rows, loaded_at) "
+            "VALUES (:source, :checksum, :dt_partition, :rows, :loaded_at)"
         )
-        hotels["lon"] = (
-            hotels["coordinates"].apply(
-                lambda x: x.split(",")[1]).astype(float)
+        connection.execute(
+            query,
+            {
+                "source": source[0],
+                "checksum": source[1],
+                "dt_partition": ",".join(sorted(partitions)),
+                "rows": int(rows),
+                "loaded_at": datetime.datetime.now(),
+            },
         )
-        hotels.drop("coordinates", axis=1, inplace=True)
-        for col in mapper.values():
-            hotels[col] = hotels[col].apply(get_float)
-        hotels["rating"] = hotels["rating"].str.replace(",", ".").astype(float)
-        hotels["dt_partition"] = datetime.date.today().strftime("%Y-%m-%d")
-        hotels.to_sql("hotels", con=self.engine,
-                      if_exists="append", index=False)
-        print(f"Inserted {hotels.shape[0]} in Hotels table")
-        os.remove("bookings_hotels.json")
+
+    @staticmethod
+    def _close_missing(connection, listed: pd.DataFrame) -> None:
+        for day, hotels in listed.groupby("dt_partition"):
+            close_missing(connection, day, hotels)
+
+    def close_missing_hotels(self, listed: pd.DataFrame, lock: str = "hotels") -> None:
+        """
+        Closes the hotels missing from a full crawl loaded in batches, with the
+        change-only history. Other storages have no open versions to close.\n
+        Args:
+            listed (pd.DataFrame): name, city and dt_partition of every hotel
+                of the crawl.
+            lock (str, optional): Name of the advisory lock of the batches.
+        """
+        if self.hotels_storage != "changes" or not self.full_crawl or listed.empty:
+            return
+        with self.engine.begin() as connection:
+            if self.engine.dialect.name == "postgresql":
+                connection.execute(
+                    text("SELECT pg_advisory_xact_lock(hashtext(:lock))"), {"lock": lock}
+                )
+            self._close_missing(connection, listed)
+            rollups.refresh(connection, "hotel_scores",
+                            set(map(str, listed["dt_partition"].unique())))
+
+    def load_hotels(self, hotels: pd.DataFrame, lock: str = "hotels"):
+        """
+        Loads a batch of cleaned hotels, as streamed by the crawl.\n
+        Batches have no source file, they are serialized by an advisory lock
+        instead, since shards refresh the rollups of the same day.
+        """
+        return self._load([hotels], "hotels", lock=lock)
+
+    def record_stream(self, name: str, partitions: set, rows: int) -> None:
+        """
+        Records hotels streamed by a crawl in etl_state, so readers of the last
+        load time see the new data.
+        """
+        stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+        with self.engine.begin() as connection:
+            self._record_source(connection, (name, f"stream-{stamp}"), partitions, rows)
+
+    def write_snapshot(self):
+        """
+        Writes the Arrow snapshot read by the front, when a directory is set.
+        """
+        if self.snapshot_dir is None:
+            return None
+        with metrics.timer("snapshot"):
+            return write_snapshot(self.engine, self.snapshot_dir)
+
+    def transfrom_weather(self):
+        source = self._pending_source("weather")
+        if source is None:
+            return None
+        dt_partition = datetime.date.today().strftime("%Y-%m-%d")
+        frames = self._clean_chunks("weather", clean_weather, dt_partition)
+        return self._load(frames, "weather", source)
+
+    def transform_forecast(self):
+        # full resolution forecasts are only loaded when a source is configured
+        if "weather_forecast" not in self.sources:
+            return None
+        source = self._pending_source("weather_forecast")
+        if source is None:
+            return None
+        dt_partition = datetime.date.today().strftime("%Y-%m-%d")
+        frames = self._clean_chunks("weather_forecast", clean_weather, dt_partition)
+        return self._load(frames, "weather_forecast", source)
+
+    def transform_hotels(self):
+        source = self._pending_source("hotels")
+        if source is None:
+            return None
+        dt_partition = datetime.date.today().strftime("%Y-%m-%d")
+        frames = self._clean_chunks("hotels", clean_hotels, dt_partition)
+        hotels = self._load(frames, "hotels", source, complete=self.full_crawl)
+        os.remove(self.sources["hotels"])
         return hotels
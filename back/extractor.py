@@ -0,0 +1,77 @@
+import os
+import json
+from lxml import etree, html
+from parsel.csstranslator import HTMLTranslator
+
+DEFAULT_SELECTORS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectors.json')
+
+
+class HotelExtractor:
+    '''
+    Extracts hotel fields from a hotel details page.\n
+    The selectors of the config file are compiled to lxml XPath objects once,
+    then each page is parsed a single time and queried with them.\n
+    Args:
+        config_path (str, optional): Path of the JSON selector config. Defaults to selectors.json.
+    '''
+
+    def __init__(self, config_path: str = DEFAULT_SELECTORS):
+        with open(config_path, 'r', encoding='utf-8') as file:
+            config = json.load(file)
+        self.fields = {name: self._compile(spec) for name, spec in config['fields'].items()}
+        subscores = config.get('subscores')
+        self.subscores = None
+        if subscores:
+            self.subscores = {key: self._compile(spec) for key, spec in subscores.items()}
+        self.parser = html.HTMLParser(recover=True, encoding='utf-8')
+
+    @staticmethod
+    def _compile(spec: dict) -> etree.XPath:
+        '''
+        Compiles a selector given as {"css": ...} or {"xpath": ...}, CSS selectors
+        accept the Scrapy ::text and ::attr() pseudo elements.
+        '''
+        if 'css' in spec:
+            return etree.XPath(HTMLTranslator().css_to_xpath(spec['css']))
+        return etree.XPath(spec['xpath'])
+
+    @staticmethod
+    def _first(results):
+        '''
+        Returns the first match as a string, like Scrapy's SelectorList.get().
+        '''
+        if not results:
+            return None
+        result = results[0]
+        if isinstance(result, str):
+            return str(result)
+        return etree.tostring(result, encoding='unicode', method='html', with_tail=False)
+
+    def parse(self, body: bytes, encoding: str = 'utf-8'):
+        '''
+        Parses a page into an lxml tree.
+        '''
+        parser = self.parser
+        if encoding.lower().replace('-', '') != 'utf8':
+            parser = html.HTMLParser(recover=True, encoding=encoding)
+        return etree.fromstring(body, parser=parser)
+
+    def extract(self, body: bytes, encoding: str = 'utf-8') -> tuple:
+        '''
+        Extracts the configured fields of a hotel page.\n
+        Args:
+            body (bytes): The raw page.
+            encoding (str, optional): The page encoding. Defaults to utf-8.
+        Returns:
+            tuple: Dict of the fields and dict of the review subscores keyed by label.
+        '''
+        tree = self.parse(body, encoding)
+        if tree is None:
+            return {name: None for name in self.fields}, {}
+        fields = {name: self._first(xpath(tree)) for name, xpath in self.fields.items()}
+        subscores = {}
+        if self.subscores:
+            for element in self.subscores['container'](tree):
+                label = self._first(self.subscores['label'](element))
+                subscores[label] = self._first(self.subscores['value'](element))
+        return fields, subscores
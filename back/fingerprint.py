@@ -0,0 +1,107 @@
+import time
+import sqlite3
+import threading
+
+
+class FingerprintStore:
+    '''
+    On-disk SQLite store of the crawled pages fingerprints.\n
+    Keeps, for each page, the validators sent back by the server (ETag and
+    Last-Modified) and the hash of the last emitted item, so unchanged pages
+    can be requested conditionally and skipped.\n
+    Args:
+        path (str): Path of the SQLite database file.
+        full_refresh (int): Number of seconds after which a page is fetched and
+            emitted again whatever its fingerprint.
+    '''
+
+    def __init__(self, path: str = 'fingerprints.db', full_refresh: int = 7 * 24 * 3600):
+        self.path = path
+        self.full_refresh = full_refresh
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+            'content_hash TEXT, refreshed_at REAL, seen_at REAL)'
+        )
+        self._conn.commit()
+
+    def get(self, url: str):
+        '''
+        Looks up the fingerprint of a page.\n
+        Args:
+            url (str): Key of the page.
+        Returns:
+            dict: The stored fingerprint, or None for an unknown page.
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT etag, last_modified, content_hash, refreshed_at '
+                'FROM pages WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['etag', 'last_modified', 'content_hash', 'refreshed_at'], row))
+
+    def is_fresh(self, fingerprint: dict) -> bool:
+        '''
+        Tells whether a page was fully refreshed within the refresh interval.
+        '''
+        return (fingerprint is not None
+                and fingerprint['refreshed_at'] >= time.time() - self.full_refresh)
+
+    def conditional_headers(self, url: str) -> dict:
+        '''
+        Builds the conditional request headers of a page.\n
+        Args:
+            url (str): Key of the page.
+        Returns:
+            dict: If-None-Match and If-Modified-Since headers, empty when the
+            page is unknown or due for a full refresh.
+        '''
+        fingerprint = self.get(url)
+        headers = {}
+        if not self.is_fresh(fingerprint):
+            return headers
+        if fingerprint['etag']:
+            headers['If-None-Match'] = fingerprint['etag']
+        if fingerprint['last_modified']:
+            headers['If-Modified-Since'] = fingerprint['last_modified']
+        return headers
+
+    def update(self, url: str, etag: str, last_modified: str, content_hash: str,
+               refreshed: bool) -> None:
+        '''
+        Stores the fingerprint of a fetched page.\n
+        Args:
+            url (str): Key of the page.
+            etag (str): ETag header of the response.
+            last_modified (str): Last-Modified header of the response.
+            content_hash (str): Hash of the extracted item.
+            refreshed (bool): Whether the item was emitted.
+        '''
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO pages (url, etag, last_modified, content_hash, refreshed_at, seen_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(url) DO UPDATE SET '
+                'etag = excluded.etag, last_modified = excluded.last_modified, '
+                'content_hash = excluded.content_hash, seen_at = excluded.seen_at'
+                + (', refreshed_at = excluded.refreshed_at' if refreshed else ''),
+                (url, etag, last_modified, content_hash, now, now),
+            )
+            self._conn.commit()
+
+    def touch(self, url: str) -> None:
+        '''
+        Records that a page was seen unchanged.
+        '''
+        with self._lock:
+            self._conn.execute(
+                'UPDATE pages SET seen_at = ? WHERE url = ?', (time.time(), url)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
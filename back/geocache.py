@@ -0,0 +1,123 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+
+class GeocodeCache:
+    '''
+    On-disk SQLite cache of city coordinates with TTL based invalidation.\n
+    Fresh entries are preloaded in memory when the cache is opened, so a warm
+    run answers every lookup without touching the disk or the network.\n
+    Args:
+        path (str): Path of the SQLite database file.
+        ttl (int): Number of seconds an entry stays valid.
+    '''
+
+    def __init__(self, path: str = 'geocode.db', ttl: int = 90 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS geocode ('
+            'city TEXT PRIMARY KEY, lat REAL, lon REAL, updated_at REAL)'
+        )
+        self._conn.commit()
+        self.entries = self._preload()
+
+    def _preload(self) -> dict:
+        '''
+        Loads every non expired entry in memory.\n
+        Returns:
+            dict: Coordinates tuple keyed by city name.
+        '''
+        rows = self._conn.execute(
+            'SELECT city, lat, lon FROM geocode WHERE updated_at >= ?',
+            (time.time() - self.ttl,),
+        ).fetchall()
+        logging.info(f'Geocode cache preloaded {len(rows)} cities')
+        return {city: (lat, lon) for city, lat, lon in rows}
+
+    def get(self, city: str):
+        '''
+        Looks up the coordinates of a city.\n
+        Args:
+            city (str): Name of the city.
+        Returns:
+            tuple: Latitude and longitude, or None when missing or expired.
+        '''
+        return self.entries.get(city)
+
+    def set(self, city: str, lat: float, lon: float) -> None:
+        '''
+        Stores the coordinates of a city.\n
+        Args:
+            city (str): Name of the city.
+            lat (float): Latitude coordinate of the city.
+            lon (float): Longitude coordinate of the city.
+        '''
+        self.set_many([(city, lat, lon)])
+
+    def set_many(self, rows: list, overwrite: bool = True) -> int:
+        '''
+        Stores the coordinates of several cities in one transaction.\n
+        Args:
+            rows (list): (city, lat, lon) tuples.
+            overwrite (bool, optional): Replace fresh entries. When False only
+                missing or expired entries are written. Defaults to True.
+        Returns:
+            int: Number of rows written.
+        '''
+        now = time.time()
+        query = (
+            'INSERT INTO geocode (city, lat, lon, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(city) DO UPDATE SET lat = excluded.lat, '
+            'lon = excluded.lon, updated_at = excluded.updated_at'
+        )
+        if not overwrite:
+            query += f' WHERE geocode.updated_at < {now - self.ttl}'
+        values = [(city, float(lat), float(lon), now) for city, lat, lon in rows]
+        with self._lock:
+            written = self._conn.executemany(query, values).rowcount
+            self._conn.commit()
+            self.entries = self._preload()
+        return written
+
+    def seed_from_hotels(self, engine, overwrite: bool = False) -> int:
+        '''
+        Bulk fills the cache with the mean hotel coordinates of each city.\n
+        Args:
+            engine (sqlalchemy.Engine): Engine connected to the Kayak database.
+            overwrite (bool, optional): Replace fresh entries. Defaults to False.
+        Returns:
+            int: Number of cities written.
+        '''
+        from sqlalchemy import text
+
+        query = text(
+            'SELECT city, AVG(lat) AS lat, AVG(lon) AS lon FROM hotels '
+            'WHERE lat IS NOT NULL AND lon IS NOT NULL GROUP BY city'
+        )
+        with engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        # the spider stores city names with dashes instead of spaces
+        rows = [(city.replace('-', ' '), lat, lon) for city, lat, lon in rows]
+        written = self.set_many(rows, overwrite=overwrite)
+        logging.info(f'Seeded geocode cache with {written} cities from hotels')
+        return written
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from param import geocode_db, geocode_ttl
+
+    load_dotenv()
+    cache = GeocodeCache(geocode_db, geocode_ttl)
+    print(f'Seeded {cache.seed_from_hotels(create_engine(os.getenv("POSTGRES")))} cities')
+    cache.close()
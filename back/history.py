@@ -0,0 +1,194 @@
+import os
+import sys
+import datetime
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, text
+from data_models import Base
+from dimension import DIM_COLUMNS, DIM_KEYS, read_dim
+from loader import BulkLoader
+from metrics import metrics
+
+# columns whose change opens a new version of a hotel
+TRACKED_COLUMNS = [col.name for col in Base.metadata.tables["hotel_scores"].columns
+                   if col.name not in ("hotel_id", "valid_from", "valid_to", "row_hash")]
+# hotel ids per statement, below the SQLite limit of bound parameters
+ID_BATCH = 10000
+
+AS_OF = f"""
+SELECT {", ".join(f"d.{col}" for col in DIM_COLUMNS)},
+       {", ".join(f"s.{col}" for col in TRACKED_COLUMNS)},
+       s.valid_from, s.valid_to
+FROM hotel_scores s
+JOIN hotel_dim d ON d.hotel_id = s.hotel_id
+WHERE s.valid_from <= :day AND (s.valid_to IS NULL OR s.valid_to > :day)
+"""
+
+
+def _as_date(value) -> datetime.date:
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def row_hash(rows: pd.DataFrame) -> pd.Series:
+    """
+    Hashes the tracked columns of each row.\n
+    Values are compared as floats, so a reviews column read as integers in one
+    load and as floats in another still gives the same hash.
+    """
+    values = rows[TRACKED_COLUMNS].astype("float64")
+    return pd.util.hash_pandas_object(values, index=False).astype("int64")
+
+
+def _current(connection) -> pd.DataFrame:
+    # valid_from and row_hash of the open version, latest_from of the last one,
+    # which is closed for a hotel missing from the last complete load
+    current = pd.read_sql(
+        text("SELECT hotel_id, MAX(valid_from) AS latest_from, "
+             "MAX(CASE WHEN valid_to IS NULL THEN valid_from END) AS valid_from, "
+             "MAX(CASE WHEN valid_to IS NULL THEN row_hash END) AS row_hash "
+             "FROM hotel_scores GROUP BY hotel_id"),
+        connection,
+    )
+    current["latest_from"] = pd.to_datetime(current["latest_from"])
+    current["valid_from"] = pd.to_datetime(current["valid_from"])
+    # nullable, hashes of new hotels must not turn the column into floats
+    current["row_hash"] = current["row_hash"].astype("Int64")
+    return current
+
+
+def _by_ids(connection, statement: str, ids, day: datetime.date) -> None:
+    query = text(statement).bindparams(bindparam("ids", expanding=True))
+    ids = [int(hotel_id) for hotel_id in ids]
+    for start in range(0, len(ids), ID_BATCH):
+        connection.execute(query, {"ids": ids[start:start + ID_BATCH], "day": str(day)})
+
+
+def _load_day(connection, rows: pd.DataFrame, day: datetime.date,
+              load_mode: str, batch_size: int) -> tuple:
+    rows = rows.assign(row_hash=row_hash(rows))
+    merged = rows.merge(_current(connection), on="hotel_id", how="left",
+                        suffixes=("", "_current"))
+    opened = pd.Timestamp(day)
+    # a version opened after this day already covers it
+    late = merged["latest_from"] > opened
+    differs = merged["row_hash"].ne(merged["row_hash_current"]).fillna(True).astype(bool)
+    changed = merged[~late & differs]
+    if changed.empty:
+        return 0, int(late.sum())
+    reloaded = changed.loc[changed["valid_from"] == opened, "hotel_id"]
+    closed = changed.loc[changed["valid_from"] < opened, "hotel_id"]
+    # a version opened the same day is replaced instead of closed
+    _by_ids(connection, "DELETE FROM hotel_scores "
+                        "WHERE hotel_id IN :ids AND valid_from = :day", reloaded, day)
+    _by_ids(connection, "UPDATE hotel_scores SET valid_to = :day "
+                        "WHERE hotel_id IN :ids AND valid_to IS NULL", closed, day)
+    versions = changed[["hotel_id", "row_hash", *TRACKED_COLUMNS]].assign(
+        valid_from=day, valid_to=None
+    )
+    if load_mode == "copy":
+        BulkLoader(batch_size).load(connection, versions, "hotel_scores")
+    else:
+        versions.to_sql("hotel_scores", con=connection, if_exists="append", index=False)
+    return versions.shape[0], int(late.sum())
+
+
+def load_changes(connection, facts: pd.DataFrame, load_mode: str = "copy",
+                 batch_size: int = 50000) -> int:
+    """
+    Loads daily hotel scores as change-only history (slowly changing
+    dimension of type 2).\n
+    Each row is compared with the current version of its hotel through a hash
+    of the tracked columns. Unchanged hotels are skipped, a changed hotel has
+    its current version closed on the day of the row and a new version
+    opened. Hotels missing from a load keep their current version open, see
+    close_missing for complete loads. Days must be loaded in order, a row
+    older than the current version of its hotel is skipped and reported.\n
+    Args:
+        connection (sqlalchemy.Connection): Connection of the load transaction.
+        facts (pd.DataFrame): Rows matching the HotelDailyTable schema.
+        load_mode (str, optional): "copy" or "insert", as in Kayak.
+            Defaults to "copy".
+        batch_size (int, optional): Rows per COPY batch. Defaults to 50000.
+    Returns:
+        int: Number of versions written.
+    """
+    written = 0
+    late = 0
+    for day, rows in facts.groupby("dt_partition", sort=True):
+        day_written, day_late = _load_day(connection, rows, _as_date(day), load_mode, batch_size)
+        written += day_written
+        late += day_late
+    print(f"Wrote {written} changed versions in hotel_scores")
+    if late:
+        metrics.count("rows_skipped", late, table="hotel_scores", reason="late")
+        print(f"Skipped {late} rows older than the current version of their hotel, "
+              "days must be loaded in order")
+    return written
+
+
+def close_missing(connection, day, hotels: pd.DataFrame) -> int:
+    """
+    Closes the versions of the hotels missing from a complete load of a day,
+    as a delisted hotel is missing from every later day of the wide storage.\n
+    Only the cities present in the load are considered. A version opened that
+    same day by an earlier load is removed instead.\n
+    Args:
+        connection (sqlalchemy.Connection): Connection of the load transaction.
+        day (str or datetime.date): Day of the load.
+        hotels (pd.DataFrame): name and city of every hotel of the load.
+    Returns:
+        int: Number of hotels closed.
+    """
+    day = _as_date(day)
+    cities = hotels["city"].dropna().unique().tolist()
+    if not cities:
+        return 0
+    dim = read_dim(connection, cities)[["hotel_id", *DIM_KEYS]]
+    seen = dim.merge(hotels[DIM_KEYS].drop_duplicates(), on=DIM_KEYS)["hotel_id"]
+    current = _current(connection).dropna(subset=["valid_from"])
+    current = current[current["hotel_id"].isin(dim["hotel_id"])
+                      & ~current["hotel_id"].isin(seen)]
+    opened = pd.Timestamp(day)
+    _by_ids(connection, "DELETE FROM hotel_scores "
+                        "WHERE hotel_id IN :ids AND valid_from = :day",
+            current.loc[current["valid_from"] == opened, "hotel_id"], day)
+    # versions opened after the day belong to later loads
+    _by_ids(connection, "UPDATE hotel_scores SET valid_to = :day "
+                        "WHERE hotel_id IN :ids AND valid_to IS NULL",
+            current.loc[current["valid_from"] < opened, "hotel_id"], day)
+    closed = int((current["valid_from"] <= opened).sum())
+    print(f"Closed {closed} hotels missing from the load of {day}")
+    return closed
+
+
+def as_of(connection, day, city: str = None) -> pd.DataFrame:
+    """
+    Rebuilds the hotels as they were on a given day from their versions.\n
+    Args:
+        connection (sqlalchemy.Connection): Connection to the Kayak database.
+        day (str or datetime.date): Day to rebuild, as YYYY-MM-DD.
+        city (str, optional): Only rebuild the hotels of this city.
+    Returns:
+        pd.DataFrame: One row per hotel with its attributes, the scores valid on
+        that day and the validity range of the version.
+    """
+    query = AS_OF
+    params = {"day": str(_as_date(day))}
+    if city is not None:
+        query += " AND d.city = :city"
+        params["city"] = city
+    return pd.read_sql(text(query + " ORDER BY d.name"), connection, params=params)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if len(sys.argv) < 2:
+        print("Usage: python history.py YYYY-MM-DD [city]")
+        sys.exit(1)
+    with create_engine(os.getenv("POSTGRES")).connect() as connection:
+        print(as_of(connection, sys.argv[1], *sys.argv[2:3]).to_string())
@@ -0,0 +1,137 @@
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+from sqlalchemy import Date, DateTime, Float, Integer, String
+from data_models import Base
+
+PARTITIONING = ("dt_partition", "city")
+ARROW_TYPES = {
+    String: pa.string(),
+    Float: pa.float64(),
+    Integer: pa.int64(),
+    Date: pa.date32(),
+    DateTime: pa.timestamp("us"),
+}
+
+
+def table_schema(table_name: str) -> pa.Schema:
+    """
+    Builds the Arrow schema of a table declared in data_models.\n
+    Args:
+        table_name (str): Name of the table.
+    Returns:
+        pa.Schema: One field per column, in declaration order.
+    """
+    table = Base.metadata.tables[table_name]
+    # partition columns are directory names, kept as strings
+    return pa.schema([
+        (col.name, pa.string() if col.name in PARTITIONING else ARROW_TYPES[type(col.type)])
+        for col in table.columns
+    ])
+
+
+class DataLake:
+    """
+    Parquet datasets partitioned by dt_partition and city.
+
+    Each dataset lives in <root>/<dataset>/dt_partition=.../city=.../ so readers
+    filtering on those columns only open the matching directories.
+    """
+
+    def __init__(self, root: str, filesystem=None):
+        self.root = root.rstrip("/")
+        self.filesystem = filesystem
+        self.partitioning = ds.partitioning(
+            pa.schema([(name, pa.string()) for name in PARTITIONING]), flavor="hive"
+        )
+
+    def _path(self, dataset: str) -> str:
+        return f"{self.root}/{dataset}"
+
+    @staticmethod
+    def _conform(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+        """
+        Casts a DataFrame to a schema, missing columns are filled with nulls
+        and extra columns dropped.
+        """
+        df = df.copy()
+        for field in schema:
+            if field.name not in df:
+                df[field.name] = None
+            elif pa.types.is_timestamp(field.type):
+                df[field.name] = pd.to_datetime(df[field.name])
+            elif pa.types.is_date(field.type):
+                df[field.name] = pd.to_datetime(df[field.name]).dt.date
+        return pa.Table.from_pandas(
+            df[schema.names], schema=schema, preserve_index=False, safe=False
+        )
+
+    def write(self, df: pd.DataFrame, dataset: str, schema: pa.Schema = None,
+              append: bool = False) -> None:
+        """
+        Writes rows to a dataset.\n
+        Args:
+            df (pd.DataFrame): Rows holding the dt_partition and city columns.
+            dataset (str): Name of the dataset, such as "hotels" or "raw/hotels".
+            schema (pa.Schema, optional): Schema of the files, inferred when None.
+            append (bool, optional): Keep the files already written in the
+                partitions of df. By default they are replaced, which makes a
+                re-run of the same day idempotent.
+        """
+        if schema is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        else:
+            table = self._conform(df, schema)
+        ds.write_dataset(
+            table,
+            self._path(dataset),
+            format="parquet",
+            partitioning=self.partitioning,
+            filesystem=self.filesystem,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore" if append else "delete_matching",
+        )
+
+    def clear(self, dataset: str, dt_partition: str) -> None:
+        """
+        Removes every city partition of a day from a dataset, before the day
+        is written again in several appended parts.
+        """
+        filesystem = self.filesystem or fs.LocalFileSystem()
+        path = f"{self._path(dataset)}/dt_partition={dt_partition}"
+        if filesystem.get_file_info(path).type != fs.FileType.NotFound:
+            filesystem.delete_dir(path)
+
+    def read(self, dataset: str, columns: list = None, filters: dict = None) -> pd.DataFrame:
+        """
+        Reads a dataset with column projection and partition pruning.\n
+        Args:
+            dataset (str): Name of the dataset.
+            columns (list, optional): Columns to read, all when None.
+            filters (dict, optional): Column conditions, a value for equality, a
+                list for membership or a (start, end) tuple for an inclusive range,
+                e.g. {"city": "Paris", "dt_partition": ("2024-03-01", "2024-03-31")}.
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        dataset = ds.dataset(
+            self._path(dataset),
+            format="parquet",
+            partitioning=self.partitioning,
+            filesystem=self.filesystem,
+        )
+        expression = None
+        for column, condition in (filters or {}).items():
+            field = pc.field(column)
+            if isinstance(condition, tuple):
+                start, end = condition
+                predicate = (field >= start) & (field <= end)
+            elif isinstance(condition, list):
+                predicate = field.isin(condition)
+            else:
+                predicate = field == condition
+            expression = predicate if expression is None else expression & predicate
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
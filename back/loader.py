@@ -0,0 +1,93 @@
+import io
+import logging
+import pandas as pd
+from sqlalchemy import Integer
+from data_models import Base
+
+
+class BulkLoader:
+    """
+    Bulk loader pushing DataFrames into PostgreSQL.
+
+    Rows are streamed in batches with COPY FROM STDIN into a temporary staging
+    table, then merged into the target table with INSERT ... ON CONFLICT so that
+    loading the same partition twice updates rows instead of failing. Rows
+    identical to the stored ones are left untouched.
+    """
+
+    def __init__(self, batch_size: int = 50000):
+        self.batch_size = batch_size
+
+    def load(self, connection, df: pd.DataFrame, table_name: str, keys: list = None) -> int:
+        """
+        Upserts a DataFrame into a table declared in data_models.\n
+        Args:
+            connection (sqlalchemy.Connection): Connection inside an open transaction.
+            df (pd.DataFrame): Rows to load, extra columns are ignored.
+            table_name (str): Name of the target table.
+            keys (list, optional): Columns of a unique constraint to merge on,
+                such as a natural key next to a generated primary key.
+                Defaults to the primary key.
+        Returns:
+            int: Number of rows inserted or updated.
+        """
+        table = Base.metadata.tables[table_name]
+        columns = [col.name for col in table.columns if col.name in df.columns]
+        keys = keys or [col.name for col in table.primary_key.columns]
+        df = df[columns].copy()
+        for col in table.columns:
+            if col.name in columns and isinstance(col.type, Integer):
+                df[col.name] = df[col.name].astype("Int64")
+
+        staging = f"{table_name}_staging"
+        cursor = connection.connection.cursor()
+        # only the loaded columns, generated keys are left to the target table
+        cursor.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS "{staging}" ON COMMIT DROP AS '
+            f'SELECT {self._quote(columns)} FROM "{table_name}" WITH NO DATA'
+        )
+        copy_sql = (
+            f'COPY "{staging}" ({self._quote(columns)}) FROM STDIN WITH (FORMAT csv)'
+        )
+        merge_sql = self._merge_query(table_name, staging, columns, keys)
+
+        loaded = 0
+        for start in range(0, len(df), self.batch_size):
+            buffer = io.StringIO()
+            df.iloc[start:start + self.batch_size].to_csv(
+                buffer, index=False, header=False
+            )
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+            cursor.execute(merge_sql)
+            loaded += cursor.rowcount
+            cursor.execute(f'TRUNCATE "{staging}"')
+        cursor.close()
+        logging.info(f"Upserted {loaded} rows in {table_name}")
+        return loaded
+
+    @staticmethod
+    def _quote(columns: list) -> str:
+        return ", ".join(f'"{col}"' for col in columns)
+
+    def _merge_query(self, table_name: str, staging: str, columns: list, keys: list) -> str:
+        """
+        Builds the INSERT ... ON CONFLICT statement merging staging into the table.\n
+        Duplicated keys inside a batch are collapsed with DISTINCT ON, as
+        PostgreSQL refuses to update the same row twice in one statement.
+        """
+        updates = [col for col in columns if col not in keys]
+        if updates:
+            target = ", ".join(f'"{table_name}"."{col}"' for col in updates)
+            excluded = ", ".join(f'EXCLUDED."{col}"' for col in updates)
+            conflict = "DO UPDATE SET " + ", ".join(
+                f'"{col}" = EXCLUDED."{col}"' for col in updates
+            ) + f" WHERE ({target}) IS DISTINCT FROM ({excluded})"
+        else:
+            conflict = "DO NOTHING"
+        return (
+            f'INSERT INTO "{table_name}" ({self._quote(columns)}) '
+            f'SELECT DISTINCT ON ({self._quote(keys)}) {self._quote(columns)} '
+            f'FROM "{staging}" '
+            f"ON CONFLICT ({self._quote(keys)}) {conflict}"
+        )
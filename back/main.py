@@ -1,32 +1,183 @@
-import os
-import threading
-from scraper import Crawler, HotelSpider
-from caller import WeatherCall
-from etl import Kayak
-from param import cities, tables
+import sys
+import argparse
+from dag import Dag
+from metrics import metrics
+from param import (cities, weather_workers, geocode_db, geocode_ttl,
+                   load_mode, load_batch_size, etl_chunksize, hotels_feed, sources,
+                   incremental_crawl, fingerprint_db, full_refresh_interval,
+                   crawl_shards, crawl_settings, s3_compression, lake_enabled,
+                   lake_prefix, retention_days, full_weather, snapshot_dir, hotels_storage,
+                   stream_hotels, stream_batch_size,
+                   dag_workers, stage_retries,
+                   metrics_report, metrics_textfile, profile_stages, profile_dir)
 
+# stages run by each subcommand, modules are imported by the stages themselves
+# so a single command only loads what it uses
+COMMANDS = {
+    'weather': ['geocode', 'fetch_weather', 'upload_weather'],
+    'crawl': (['database'] if stream_hotels else []) + ['crawl', 'upload_hotels'],
+    'etl': ['database', 'weather_etl', 'hotels_etl', 'retention', 'snapshot'],
+}
 
-def get_weather_data():
-    weather = WeatherCall(cities)
-    weather.to_s3()
 
+def weather_caller():
+    from caller import WeatherCall
+    from geocache import GeocodeCache
 
-def get_hotels_data():
-    crawl = Crawler(HotelSpider, cities, "bookings_hotels.json")
-    crawl.aws.push_to_s3(crawl.filename)
+    geocache = GeocodeCache(geocode_db, geocode_ttl)
+    return WeatherCall(cities, max_workers=weather_workers, geocache=geocache, fetch=False)
 
 
-def get_all_data():
-    thread1 = threading.Thread(target=get_weather_data)
-    thread2 = threading.Thread(target=get_hotels_data)
-    thread1.start()
-    thread2.start()
-    thread1.join()
-    thread2.join()
+def geocode():
+    return weather_caller().geocode()
 
 
-if __name__ == "__main__":
-    get_all_data()
-    os.system("clear")
-    data = Kayak(tables)
+def fetch_weather(geocode):
+    weather = weather_caller()
+    weather.weather = weather.get_cities_weather(geocode)
+    files = [weather.save(sources['weather'])]
+    if full_weather:
+        files.append(weather.save_forecast(sources['weather_forecast']))
+    return files
+
+
+def crawl(**upstream):
+    from scraper import Crawler, HotelSpider
+
+    # the reactor cannot run in a DAG worker thread, the crawl runs in child processes
+    settings = crawl_settings
+    if stream_hotels:
+        from pipelines import stream_settings
+
+        # the merged feed is archived by upload_hotels, the feeds of the shards
+        # would each be logged as the latest upload
+        settings = {**crawl_settings,
+                    **stream_settings(stream_batch_size, hotels_storage, load_mode,
+                                      archive=False, full_crawl=not incremental_crawl)}
+    crawler = Crawler(HotelSpider, cities, hotels_feed, shards=crawl_shards,
+                      settings=settings, subprocess=True,
+                      incremental=incremental_crawl, fingerprint_db=fingerprint_db,
+                      full_refresh=full_refresh_interval)
+    return crawler.filename
+
+
+def upload_weather(fetch_weather):
+    from big_data import get_aws
+
+    aws = get_aws()
+    for file_path in fetch_weather:
+        aws.push_to_s3(file_path, compression=s3_compression)
+
+
+def upload_hotels(crawl):
+    from big_data import get_aws
+
+    get_aws().push_to_s3(crawl, compression=s3_compression)
+
+
+def database():
+    from big_data import get_aws
+    from etl import Kayak
+    from param import tables
+
+    lake = get_aws().lake(lake_prefix) if lake_enabled else None
+    return Kayak(tables, sources=sources, load_mode=load_mode,
+                 batch_size=load_batch_size, chunksize=etl_chunksize, lake=lake,
+                 retention_days=retention_days, snapshot_dir=snapshot_dir,
+                 hotels_storage=hotels_storage, full_crawl=not incremental_crawl, run=False)
+
+
+def weather_etl(database, **upstream):
+    database.transfrom_weather()
+    database.transform_forecast()
 
+
+def hotels_etl(database, **upstream):
+    # the feed is removed once loaded, so it must be archived first
+    database.transform_hotels()
+
+
+def retention(database, **upstream):
+    database.schema.apply_retention()
+
+
+def snapshot(database, **upstream):
+    database.write_snapshot()
+
+
+def build_pipeline(command: str = 'all') -> Dag:
+    if incremental_crawl and hotels_storage != 'changes':
+        # checked before crawling, the daily rows of unchanged hotels would be missing
+        raise ValueError("incremental_crawl needs hotels_storage = 'changes'")
+    dag = Dag(workers=dag_workers)
+    dag.add('geocode', geocode)
+    dag.add('fetch_weather', fetch_weather, ['geocode'])
+    dag.add('upload_weather', upload_weather, ['fetch_weather'])
+    dag.add('database', database)
+    dag.add('weather_etl', weather_etl, ['database', 'fetch_weather'])
+    if stream_hotels:
+        # the crawl loads the hotels itself, the tables must exist first
+        dag.add('crawl', crawl, ['database'])
+        dag.add('upload_hotels', upload_hotels, ['crawl'])
+        hotels_done = 'crawl'
+    else:
+        dag.add('crawl', crawl)
+        dag.add('upload_hotels', upload_hotels, ['crawl'])
+        dag.add('hotels_etl', hotels_etl, ['database', 'upload_hotels'])
+        hotels_done = 'hotels_etl'
+    dag.add('retention', retention, ['database', 'weather_etl', hotels_done])
+    dag.add('snapshot', snapshot, ['database', 'weather_etl', hotels_done])
+    for name, retries in stage_retries.items():
+        if name in dag.stages:
+            dag.stages[name].retries = retries
+    return dag if command == 'all' else dag.select(COMMANDS[command])
+
+
+def sync(directory: str, prefix: str, start: str, end: str, workers: int) -> None:
+    from big_data import get_aws
+
+    synced = get_aws().sync(directory, prefix=prefix, start=start, end=end, workers=workers)
+    print(f"Downloaded {len(synced)} files to data/{directory}")
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run the Kayak data pipeline')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    helps = {'weather': 'geocode the cities, fetch and archive their weather',
+             'crawl': 'crawl the hotels and archive the feed',
+             'etl': 'load the local weather and hotels files into the database',
+             'all': 'run the whole pipeline, the default'}
+    for name, help_ in helps.items():
+        command = commands.add_parser(name, help=help_)
+        command.add_argument('--dry-run', action='store_true',
+                             help='print the stages and the critical path without running them')
+        command.add_argument('--profile', nargs='+', default=profile_stages, metavar='STAGE',
+                             help='run these stages, or all, under cProfile and tracemalloc, '
+                                  'whose peak memory is the one of the whole process')
+    command = commands.add_parser('sync', help='download the raw files missing locally from S3')
+    command.add_argument('--directory', default='hotels', help='directory under data/')
+    command.add_argument('--prefix', default='', help='only sync keys starting with prefix')
+    command.add_argument('--start', help='first upload date to sync, YYYY-MM-DD')
+    command.add_argument('--end', help='last upload date to sync, YYYY-MM-DD')
+    command.add_argument('--workers', type=int, default=8, help='parallel downloads')
+    # without command, as launched by cron, the whole pipeline runs
+    if not argv or argv[0] not in commands.choices and argv[0] not in ('-h', '--help'):
+        argv = ['all', *argv]
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.command == 'sync':
+        try:
+            sync(args.directory, args.prefix, args.start, args.end, args.workers)
+        finally:
+            metrics.write(metrics_report, metrics_textfile)
+    elif args.dry_run:
+        build_pipeline(args.command).run(dry_run=True)
+    else:
+        metrics.configure(args.profile, profile_dir)
+        try:
+            build_pipeline(args.command).run()
+        finally:
+            metrics.write(metrics_report, metrics_textfile)
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import cProfile
+import datetime
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _labels(labels: tuple, extra: dict = None) -> str:
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of the metrics of a pipeline run.
+
+    Timers measure the steps of the run, histograms the latency of single
+    requests and counters the items, rows and bytes going through. Metrics are
+    identified by a name and labels, e.g. timer("load", table="hotels").
+    The registry is dumped as a JSON run report and as a Prometheus textfile for
+    the node_exporter textfile collector.
+    Steps whose name or a label value is in `profile` are also run under
+    cProfile and tracemalloc, their profile is written to `profile_dir`.
+    tracemalloc sees every thread, the peak memory of a step therefore includes
+    the allocations of the steps running alongside it and is reported as
+    process_peak_memory. Profiles of steps run in spawned processes, such as
+    crawl shards, are written by the processes themselves.
+    """
+
+    def __init__(self, profile: list = None, profile_dir: str = "profiles"):
+        self._lock = threading.Lock()
+        self.configure(profile, profile_dir)
+        self.reset()
+
+    def configure(self, profile: list = None, profile_dir: str = "profiles") -> None:
+        """
+        Sets the profiled steps, "all" profiles every step.
+        """
+        self.profile = set(profile or [])
+        self.profile_dir = profile_dir
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = datetime.datetime.now()
+            self.timers = {}
+            self.counters = {}
+            self.histograms = {}
+            self.profiles = []
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Adds value to a counter, such as rows loaded or bytes sent.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """
+        Records one duration in a histogram, such as the latency of a request.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.setdefault(
+                key, {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+            )
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+
+    def _is_profiled(self, name: str, labels: dict) -> bool:
+        return bool(self.profile) and (
+            "all" in self.profile
+            or name in self.profile
+            or any(str(value) in self.profile for value in labels.values())
+        )
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Measures the wall time of a step, summed over its calls.\n
+        Args:
+            name (str): Name of the step.
+            labels: Labels of the step, e.g. table="hotels".
+        """
+        profiled = self._is_profiled(name, labels)
+        profiler = None
+        tracing = False
+        if profiled:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # a single profiler can be active at once on recent Pythons
+                logging.warning(f"Cannot profile {name}, another profiler is running")
+                profiler = None
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                tracing = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            key = _key(name, labels)
+            with self._lock:
+                timer = self.timers.setdefault(key, {"seconds": 0.0, "calls": 0})
+                timer["seconds"] += elapsed
+                timer["calls"] += 1
+            if profiled:
+                self._save_profile(name, labels, profiler, tracing)
+
+    def _save_profile(self, name: str, labels: dict, profiler, tracing: bool) -> None:
+        entry = {"name": name, "labels": labels, "path": None, "process_peak_memory": None}
+        if tracing:
+            # a step started while another traced one ran gets no peak of its own
+            entry["process_peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            stem = "-".join([name, *map(str, labels.values())])
+            entry["path"] = os.path.join(
+                self.profile_dir, f"{stem}-{datetime.datetime.now():%Y%m%d%H%M%S%f}.prof"
+            )
+            profiler.dump_stats(entry["path"])
+        with self._lock:
+            self.profiles.append(entry)
+
+    def total(self, name: str, **labels) -> float:
+        """
+        Sums the counters of a name whose labels include the given ones.
+        """
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for (counter_name, counter_labels), value in self.counters.items()
+                       if counter_name == name and wanted <= set(counter_labels))
+
+    def merge(self, report: dict) -> None:
+        """
+        Adds the metrics of a report written by another process, such as a
+        crawl shard, to this registry.
+        """
+        with self._lock:
+            for timer in report["timers"]:
+                key = _key(timer["name"], timer["labels"])
+                current = self.timers.setdefault(key, {"seconds": 0.0, "calls": 0})
+                current["seconds"] += timer["seconds"]
+                current["calls"] += timer["calls"]
+            for counter in report["counters"]:
+                key = _key(counter["name"], counter["labels"])
+                self.counters[key] = self.counters.get(key, 0) + counter["value"]
+            for histogram in report["histograms"]:
+                key = _key(histogram["name"], histogram["labels"])
+                current = self.histograms.setdefault(
+                    key, {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+                )
+                current["count"] += histogram["count"]
+                current["sum"] += histogram["sum"]
+                for i, count in enumerate(histogram["buckets"].values()):
+                    current["buckets"][i] += count
+            self.profiles.extend(report["profiles"])
+
+    def report(self) -> dict:
+        """
+        Builds the run report.\n
+        Returns:
+            dict: Timers, counters, histograms and profiles of the run.
+        """
+        finished_at = datetime.datetime.now()
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "finished_at": finished_at.isoformat(),
+                "duration": (finished_at - self.started_at).total_seconds(),
+                "timers": [
+                    {"name": name, "labels": dict(labels), **timer}
+                    for (name, labels), timer in self.timers.items()
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": histogram["count"],
+                     "sum": histogram["sum"],
+                     "buckets": dict(zip(map(str, BUCKETS), histogram["buckets"]))}
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+                "profiles": list(self.profiles),
+            }
+
+    def textfile(self) -> str:
+        """
+        Formats the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.timers}):
+                lines.append(f"# TYPE kayak_{name}_seconds gauge")
+                for (timer_name, labels), timer in self.timers.items():
+                    if timer_name == name:
+                        lines.append(f"kayak_{name}_seconds{_labels(labels)} {timer['seconds']}")
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE kayak_{name}_total counter")
+                for (counter_name, labels), value in self.counters.items():
+                    if counter_name == name:
+                        lines.append(f"kayak_{name}_total{_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE kayak_{name}_seconds histogram")
+                for (histogram_name, labels), histogram in self.histograms.items():
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram["buckets"]):
+                        le = "+Inf" if bound == float("inf") else bound
+                        lines.append(
+                            f"kayak_{name}_seconds_bucket{_labels(labels, {'le': le})} {count}"
+                        )
+                    lines.append(f"kayak_{name}_seconds_sum{_labels(labels)} {histogram['sum']}")
+                    lines.append(f"kayak_{name}_seconds_count{_labels(labels)} {histogram['count']}")
+        lines.append("# TYPE kayak_last_run_timestamp_seconds gauge")
+        lines.append(f"kayak_last_run_timestamp_seconds {time.time()}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_path: str = None, textfile_path: str = None) -> None:
+        """
+        Writes the JSON run report and the Prometheus textfile. Files are
+        replaced atomically so collectors never read a partial file.
+        """
+        outputs = []
+        if report_path:
+            outputs.append((report_path, json.dumps(self.report(), indent=4)))
+        if textfile_path:
+            outputs.append((textfile_path, self.textfile()))
+        for path, content in outputs:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                file.write(content)
+            os.replace(f"{path}.tmp", path)
+            print(f"Metrics written to {path}")
+
+
+# registry shared by the modules of a run
+metrics = Metrics()
@@ -1,4 +1,4 @@
-from data_models import WeatherTable, HotelsTable
+import os
 
 cities = ['Mont Saint Michel',
 'St Malo',
@@ -36,5 +36,95 @@ cities = ['Mont Saint Michel',
 'Bayonne',
 'La Rochelle']
 
-tables = {'weather': WeatherTable(),
-          'hotels': HotelsTable()}
\ No newline at end of file
+weather_workers = 8
+# also store every 3 hourly reading in weather_forecast, weather keeps one a day
+full_weather = True
+geocode_db = 'geocode.db'
+geocode_ttl = 90 * 24 * 3600
+load_mode = 'copy'
+load_batch_size = 50000
+# number of feed rows transformed and loaded at once, None loads whole files
+etl_chunksize = 100000
+hotels_feed = 'bookings_hotels.jsonl.gz'
+# incremental crawls only emit hotels whose page changed since the last run,
+# they need the 'changes' hotels storage below, the others expect every hotel daily
+incremental_crawl = False
+fingerprint_db = 'fingerprints.db'
+full_refresh_interval = 7 * 24 * 3600
+# the crawl is split across this many processes, settings apply to each of them
+crawl_shards = os.cpu_count() or 1
+crawl_settings = {
+    'CONCURRENT_REQUESTS': 16,
+    'AUTOTHROTTLE_ENABLED': True,
+    'AUTOTHROTTLE_TARGET_CONCURRENCY': 4.0,
+}
+# raw files are compressed before upload, 'gzip', 'zstd' or None
+s3_compression = 'gzip'
+# also write raw and cleaned rows as Parquet partitioned by day and city, opt-in
+lake_enabled = False
+lake_prefix = 'lake'
+# 'wide' stores a full hotels row a day, 'normalized' stores the static attributes
+# once in hotel_dim and the daily scores in hotel_daily, read through a hotels view,
+# 'changes' only stores a new version of the scores in hotel_scores when they change,
+# an existing database is converted once with python schema.py normalized|changes
+hotels_storage = 'wide'
+# crawled hotels are loaded in batches while the crawl runs instead of from the
+# feed once it ends, a batch failing to load fails the crawl, opt-in
+stream_hotels = False
+stream_batch_size = 2000
+# daily partitions of hotels and weather older than this are dropped, None keeps all
+retention_days = None
+# run report and Prometheus textfile written after each run, stages listed in
+# profile_stages (or "all") are also run under cProfile and tracemalloc, whose
+# peak memory covers every stage running at the same time
+metrics_report = 'run_report.json'
+metrics_textfile = os.getenv('METRICS_TEXTFILE', 'kayak.prom')
+profile_stages = []
+profile_dir = 'profiles'
+# Arrow snapshots of the dashboard data, shared with the front, None disables them
+snapshot_dir = os.getenv('SNAPSHOT_DIR', 'snapshots')
+# number of pipeline stages running at once, and extra attempts of the stages
+dag_workers = 4
+stage_retries = {'geocode': 2,
+                 'fetch_weather': 2,
+                 'crawl': 1,
+                 'upload_weather': 3,
+                 'upload_hotels': 3,
+                 'database': 2,
+                 'weather_etl': 1,
+                 'hotels_etl': 1}
+
+sources = {'weather': 'weather.json',
+           'hotels': hotels_feed}
+if full_weather:
+    sources['weather_forecast'] = 'weather_forecast.json'
+
+
+def _tables() -> dict:
+    from data_models import (WeatherTable, HotelsTable, EtlStateTable, CityRatingDaily,
+                             WeatherCityDaily, WeatherForecastTable, WeatherForecastDaily,
+                             HotelDimTable, HotelDailyTable, HotelScoresTable)
+
+    tables = {'weather': WeatherTable(),
+              'hotels': HotelsTable(),
+              'etl_state': EtlStateTable(),
+              'city_rating_daily': CityRatingDaily(),
+              'weather_city_daily': WeatherCityDaily(),
+              'weather_forecast': WeatherForecastTable(),
+              'weather_forecast_daily': WeatherForecastDaily()}
+    if hotels_storage != 'wide':
+        del tables['hotels']
+        tables['hotel_dim'] = HotelDimTable()
+    if hotels_storage == 'normalized':
+        tables['hotel_daily'] = HotelDailyTable()
+    elif hotels_storage == 'changes':
+        tables['hotel_scores'] = HotelScoresTable()
+    return tables
+
+
+def __getattr__(name: str):
+    # the table models import SQLAlchemy, only the stages reaching the database need them
+    if name == 'tables':
+        globals()['tables'] = _tables()
+        return globals()['tables']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,148 @@
+import os
+import datetime
+import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from scrapy import signals
+from scrapy.exceptions import DropItem
+from twisted.internet import threads
+from big_data import get_aws
+from etl import Kayak, clean_hotels
+from metrics import metrics
+from param import tables
+
+
+def stream_settings(batch_size: int = 2000, hotels_storage: str = 'wide',
+                    load_mode: str = 'copy', archive: bool = True,
+                    compression: str = None, full_crawl: bool = True) -> dict:
+    '''
+    Builds the Scrapy settings enabling the HotelLoadPipeline.\n
+    Args:
+        batch_size (int, optional): Hotels cleaned and loaded at once. Defaults to 2000.
+        hotels_storage (str, optional): Storage of the hotels, as in Kayak. Defaults to 'wide'.
+        load_mode (str, optional): "copy" or "insert", as in Kayak. Defaults to 'copy'.
+        archive (bool, optional): Push the feed to S3 once written. Defaults to True,
+            a sharded crawl archives its merged feed instead, every shard feed
+            would be logged as the latest upload in s3_files.log.
+        compression (str, optional): Compression of the archived feed, as in push_to_s3.
+        full_crawl (bool, optional): The crawl emits every hotel, as in Kayak. Defaults to True.\n
+    Returns:
+        dict: Settings to merge into the crawl settings.
+    '''
+    return {
+        'ITEM_PIPELINES': {'pipelines.HotelLoadPipeline': 300},
+        'KAYAK_STREAM_BATCH': batch_size,
+        'KAYAK_HOTELS_STORAGE': hotels_storage,
+        'KAYAK_LOAD_MODE': load_mode,
+        'KAYAK_ARCHIVE': archive,
+        'KAYAK_ARCHIVE_COMPRESSION': compression,
+        'KAYAK_FULL_CRAWL': full_crawl,
+    }
+
+
+class HotelLoadPipeline:
+    '''
+    Item pipeline loading the hotels into the database while the crawl runs.\n
+    Items without a name are dropped, the others are buffered and every full
+    batch is cleaned and loaded by a background thread, one batch at a time,
+    so the reactor keeps crawling meanwhile. The tables are not created here,
+    every crawl process would do it again, they must exist before the crawl.
+    A batch failing to load fails the crawl once it ends, through the
+    kayak/failed_hotels stat checked by run_crawl, as its hotels are missing.
+    The feed written by Scrapy is still the raw archive: once the feed
+    exporter closed it, it is pushed to S3 outside of the reactor thread.
+    '''
+
+    def __init__(self, batch_size: int = 2000, hotels_storage: str = 'wide',
+                 load_mode: str = 'copy', archive: bool = True, compression: str = None,
+                 full_crawl: bool = True):
+        self.batch_size = batch_size
+        self.hotels_storage = hotels_storage
+        self.load_mode = load_mode
+        self.archive = archive
+        self.compression = compression
+        self.full_crawl = full_crawl
+        self.feeds = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            batch_size=settings.getint('KAYAK_STREAM_BATCH', 2000),
+            hotels_storage=settings.get('KAYAK_HOTELS_STORAGE', 'wide'),
+            load_mode=settings.get('KAYAK_LOAD_MODE', 'copy'),
+            archive=settings.getbool('KAYAK_ARCHIVE', True),
+            compression=settings.get('KAYAK_ARCHIVE_COMPRESSION'),
+            full_crawl=settings.getbool('KAYAK_FULL_CRAWL', True),
+        )
+        pipeline.feeds = [str(path) for path in settings.getdict('FEEDS')]
+        pipeline.stats = crawler.stats
+        crawler.signals.connect(pipeline.archive_feeds, signal=signals.feed_exporter_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.kayak = Kayak(tables, sources={}, load_mode=self.load_mode,
+                           batch_size=self.batch_size, hotels_storage=self.hotels_storage,
+                           full_crawl=self.full_crawl, run=False, setup=False)
+        self.dt_partition = datetime.date.today().strftime('%Y-%m-%d')
+        self.source = spider.name
+        self.items = []
+        self.listed = []
+        self.rows = 0
+        self.failed = 0
+        # a single worker keeps the batches in order and uses one connection at once
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hotel-load')
+
+    def process_item(self, item, spider):
+        if not item.get('name'):
+            raise DropItem('Hotel without a name')
+        self.items.append(dict(item))
+        if len(self.items) >= self.batch_size:
+            self._flush()
+        return item
+
+    def _flush(self) -> None:
+        items, self.items = self.items, []
+        self.executor.submit(self._load, items)
+
+    def _load(self, items: list) -> None:
+        try:
+            with metrics.timer('transform', table='hotels'):
+                hotels = clean_hotels(pd.DataFrame(items), self.dt_partition)
+            self.kayak.load_hotels(hotels)
+            self.listed.append(hotels[['name', 'city', 'dt_partition']])
+            self.rows += len(items)
+            metrics.count('stream_batches', result='loaded')
+        except Exception as e:
+            self.failed += len(items)
+            metrics.count('stream_batches', result='failed')
+            logging.error(f'Failed to load {len(items)} hotels: {e}')
+
+    def close_spider(self, spider):
+        if self.items:
+            self._flush()
+        return threads.deferToThread(self._close)
+
+    def _close(self) -> None:
+        self.executor.shutdown(wait=True)
+        if self.listed and not self.failed:
+            # a failed batch would have its hotels closed as if delisted
+            self.kayak.close_missing_hotels(pd.concat(self.listed))
+        if self.rows:
+            self.kayak.record_stream(self.source, {self.dt_partition}, self.rows)
+        logging.info(f'Streamed {self.rows} hotels, {self.failed} failed')
+        if self.failed:
+            # Scrapy only logs errors raised while closing, run_crawl raises on the stat
+            self.stats.set_value('kayak/failed_hotels', self.failed)
+            raise RuntimeError(f'Failed to load {self.failed} streamed hotels')
+
+    def archive_feeds(self):
+        if not self.archive or not self.feeds:
+            return None
+        return threads.deferToThread(self._push_feeds)
+
+    def _push_feeds(self) -> None:
+        aws = get_aws()
+        for feed in self.feeds:
+            if os.path.exists(feed):
+                aws.push_to_s3(feed, compression=self.compression)
@@ -0,0 +1,126 @@
+import os
+from sqlalchemy import bindparam, create_engine, inspect, text
+
+# rollup statements to run after a load, keyed by the loaded table. Statements
+# on :partitions run once for all the loaded days, those on :day once per day
+ROLLUPS = {
+    "hotels": [
+        "DELETE FROM city_rating_daily WHERE dt_partition IN :partitions",
+        """
+        INSERT INTO city_rating_daily
+            (dt_partition, city, rating_sum, rating_count, reviews_sum, hotels, lat, lon)
+        SELECT dt_partition, city, SUM(rating), COUNT(rating), SUM(reviews),
+               COUNT(*), AVG(lat), AVG(lon)
+        FROM hotels
+        WHERE dt_partition IN :partitions
+        GROUP BY dt_partition, city
+        """,
+    ],
+    # change-only history, the hotels of a day are rebuilt as of that day
+    "hotel_scores": [
+        "DELETE FROM city_rating_daily WHERE dt_partition IN :partitions",
+        """
+        INSERT INTO city_rating_daily
+            (dt_partition, city, rating_sum, rating_count, reviews_sum, hotels, lat, lon)
+        SELECT DATE(:day), d.city, SUM(s.rating), COUNT(s.rating), SUM(s.reviews),
+               COUNT(*), AVG(d.lat), AVG(d.lon)
+        FROM hotel_scores s
+        JOIN hotel_dim d ON d.hotel_id = s.hotel_id
+        WHERE s.valid_from <= :day AND (s.valid_to IS NULL OR s.valid_to > :day)
+        GROUP BY d.city
+        """,
+    ],
+    "weather": [
+        "DELETE FROM weather_city_daily WHERE dt_partition IN :partitions",
+        """
+        INSERT INTO weather_city_daily (dt_partition, city, temps, feels_like)
+        SELECT dt_partition, city, AVG(temps), AVG(feels_like)
+        FROM weather
+        WHERE dt_partition IN :partitions
+        GROUP BY dt_partition, city
+        """,
+    ],
+    "weather_forecast": [
+        "DELETE FROM weather_forecast_daily WHERE dt_partition IN :partitions",
+        """
+        INSERT INTO weather_forecast_daily
+            (dt_partition, city, day, temps_min, temps_max, temps_mean,
+             feels_like_mean, readings)
+        SELECT dt_partition, city, DATE(dt_text), MIN(temps), MAX(temps), AVG(temps),
+               AVG(feels_like), COUNT(*)
+        FROM weather_forecast
+        WHERE dt_partition IN :partitions
+        GROUP BY dt_partition, city, DATE(dt_text)
+        """,
+    ],
+}
+# rollup table written by the statements of each loaded table
+TARGETS = {
+    "hotels": "city_rating_daily",
+    "hotel_scores": "city_rating_daily",
+    "weather": "weather_city_daily",
+    "weather_forecast": "weather_forecast_daily",
+}
+
+
+def _has_rows(connection, table: str) -> bool:
+    return connection.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first() is not None
+
+
+def refresh(connection, table: str, partitions) -> None:
+    """
+    Recomputes the rollups of a table for the given partitions only.\n
+    Args:
+        connection (sqlalchemy.Connection): Connection inside the load transaction.
+        table (str): Name of the loaded table.
+        partitions (iterable): dt_partition values that were loaded.
+    """
+    partitions = sorted(partitions)
+    if not partitions:
+        return
+    for statement in ROLLUPS.get(table, []):
+        if ":day" in statement:
+            for day in partitions:
+                connection.execute(text(statement), {"day": str(day)})
+            continue
+        query = text(statement).bindparams(bindparam("partitions", expanding=True))
+        connection.execute(query, {"partitions": partitions})
+
+
+def rebuild(engine, only_empty: bool = False) -> None:
+    """
+    Recomputes every rollup over the whole history, used to backfill them.\n
+    Args:
+        engine (sqlalchemy.Engine): Engine connected to the Kayak database.
+        only_empty (bool, optional): Only rebuild the empty rollups of tables
+            holding rows, such as rollups added to an existing database.
+            Defaults to False.
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        relations = set(inspector.get_table_names()) | set(inspector.get_view_names())
+        # with the change-only history, the hotels view reads the days of the rollup
+        skipped = "hotels" if "hotel_scores" in relations else None
+        for table in ROLLUPS:
+            if table not in relations or table == skipped:
+                continue
+            if only_empty and (TARGETS[table] not in relations
+                               or _has_rows(connection, TARGETS[table])
+                               or not _has_rows(connection, table)):
+                continue
+            if table == "hotel_scores":
+                query = text("SELECT valid_from FROM hotel_scores "
+                             "UNION SELECT dt_partition FROM city_rating_daily")
+            else:
+                query = text(f"SELECT DISTINCT dt_partition FROM {table}")
+            partitions = [row[0] for row in connection.execute(query)]
+            refresh(connection, table, partitions)
+            if only_empty:
+                print(f"Backfilled {TARGETS[table]} from {table}")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    rebuild(create_engine(os.getenv("POSTGRES")))
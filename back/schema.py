@@ -0,0 +1,335 @@
+import os
+import sys
+import datetime
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from data_models import Base
+from dimension import split_hotels
+from history import close_missing, load_changes
+
+PARTITIONED_TABLES = ["hotels", "hotel_daily", "weather", "weather_forecast"]
+# rollup tables whose dt_partition used to be stored as text
+DATE_KEYED_TABLES = ["city_rating_daily", "weather_city_daily"]
+
+
+def hotels_view(storage: str = "normalized") -> str:
+    """
+    Builds the hotels view over the normalized storages, with the columns of
+    the HotelsTable in the same order, so queries written against the hotels
+    table run unchanged.\n
+    With the "normalized" storage it joins hotel_daily to hotel_dim. With the
+    "changes" storage each version of hotel_scores is repeated over the days it
+    was valid, among the days with hotels in city_rating_daily.
+    """
+    dim = Base.metadata.tables["hotel_dim"].columns
+    if storage == "changes":
+        source = (
+            "(SELECT DISTINCT dt_partition FROM city_rating_daily) days "
+            "JOIN hotel_scores f ON f.valid_from <= days.dt_partition "
+            "AND (f.valid_to IS NULL OR f.valid_to > days.dt_partition) "
+            "JOIN hotel_dim d ON d.hotel_id = f.hotel_id"
+        )
+    else:
+        source = "hotel_daily f JOIN hotel_dim d ON d.hotel_id = f.hotel_id"
+    columns = [
+        "days.dt_partition" if storage == "changes" and col.name == "dt_partition"
+        else f'{"d" if col.name in dim else "f"}."{col.name}"'
+        for col in Base.metadata.tables["hotels"].columns
+    ]
+    return f"CREATE VIEW hotels AS SELECT {', '.join(columns)} FROM {source}"
+
+
+class SchemaManager:
+    """
+    Manages the daily range partitions of the hotels and weather tables, and
+    the storage of hotels as a dimension with daily or change-only scores.
+
+    Both tables are declared in data_models as PostgreSQL tables partitioned by
+    range of dt_partition. This class creates the partition of each loaded day,
+    drops partitions past the retention period and migrates tables created
+    before partitioning. Other databases have no partitions and are left as is.
+    """
+
+    def __init__(self, engine, retention_days: int = None):
+        self.engine = engine
+        self.retention_days = retention_days
+        self.enabled = engine.dialect.name == "postgresql"
+        self._known = set()
+        self._partitioned = {}
+
+    @staticmethod
+    def partition_name(table: str, day: datetime.date) -> str:
+        return f"{table}_p{day:%Y%m%d}"
+
+    @staticmethod
+    def _relkind(connection, table: str):
+        query = text(
+            "SELECT relkind FROM pg_class "
+            "WHERE relname = :table AND relnamespace = 'public'::regnamespace"
+        )
+        return connection.execute(query, {"table": table}).scalar()
+
+    def ensure_partitions(self, connection, table: str, days) -> None:
+        """
+        Creates the missing daily partitions of a table.\n
+        Args:
+            connection (sqlalchemy.Connection): Connection of the load transaction.
+            table (str): Name of the partitioned table.
+            days (iterable): Days, as dates or YYYY-MM-DD strings, about to be loaded.
+        """
+        if not self.enabled or table not in PARTITIONED_TABLES:
+            return
+        if table not in self._partitioned:
+            # tables created before partitioning stay plain until migrated
+            self._partitioned[table] = self._relkind(connection, table) == "p"
+        if not self._partitioned[table]:
+            return
+        for day in days:
+            if isinstance(day, str):
+                day = datetime.date.fromisoformat(day)
+            partition = self.partition_name(table, day)
+            if partition in self._known:
+                continue
+            # only take the DDL lock when the partition is really missing
+            if self._relkind(connection, partition) is None:
+                connection.execute(text(
+                    f'CREATE TABLE IF NOT EXISTS "{partition}" PARTITION OF "{table}" '
+                    f"FOR VALUES FROM ('{day}') TO ('{day + datetime.timedelta(days=1)}')"
+                ))
+                print(f"Create partition {partition}")
+            self._known.add(partition)
+
+    def apply_retention(self) -> list:
+        """
+        Drops the daily partitions older than retention_days, and the hotel
+        versions that ended before. Rollup tables are kept, so history charts
+        still cover the dropped days.\n
+        Returns:
+            list: Names of the dropped partitions.
+        """
+        if not self.enabled or not self.retention_days:
+            return []
+        limit = datetime.date.today() - datetime.timedelta(days=self.retention_days)
+        query = text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = :table"
+        )
+        dropped = []
+        with self.engine.begin() as connection:
+            for table in PARTITIONED_TABLES:
+                for (partition,) in connection.execute(query, {"table": table}).fetchall():
+                    day = datetime.datetime.strptime(partition[-8:], "%Y%m%d").date()
+                    if day < limit:
+                        connection.execute(text(f'DROP TABLE "{partition}"'))
+                        self._known.discard(partition)
+                        dropped.append(partition)
+            # versions of the change-only history that ended before the limit
+            if "hotel_scores" in inspect(connection).get_table_names():
+                closed = connection.execute(
+                    text("DELETE FROM hotel_scores WHERE valid_to <= :limit"),
+                    {"limit": limit},
+                ).rowcount
+                if closed:
+                    print(f"Deleted {closed} hotel_scores versions ended before {limit}")
+        if dropped:
+            print(f"Dropped {len(dropped)} partitions older than {limit}")
+        return dropped
+
+    def check_migrated(self) -> None:
+        """
+        Checks that the tables created before partitioning were migrated,
+        before the ETL loads anything. The rollups insert dates, which a text
+        dt_partition would reject on every run.\n
+        Raises:
+            RuntimeError: When a table still has its former layout.
+        """
+        if not self.enabled:
+            return
+        with self.engine.connect() as connection:
+            legacy = [table for table in PARTITIONED_TABLES
+                      if self._relkind(connection, table) == "r"]
+            query = text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = :table "
+                "AND column_name = 'dt_partition'"
+            )
+            legacy += [table for table in DATE_KEYED_TABLES
+                       if connection.execute(query, {"table": table}).scalar()
+                       not in (None, "date")]
+        if legacy:
+            raise RuntimeError(f"{', '.join(legacy)} predate the daily partitions, "
+                               "run python schema.py migrate first")
+
+    def check_hotels_storage(self, storage: str) -> None:
+        """
+        Checks that the database already uses the storage of hotels, before
+        the ETL loads anything. Converting an existing storage drops its
+        tables, it is only done by the explicit schema.py command.\n
+        Raises:
+            RuntimeError: When the hotels are kept in another storage.
+        """
+        inspector = inspect(self.engine)
+        tables = inspector.get_table_names()
+        views = inspector.get_view_names()
+        if storage == "wide" and "hotels" in views:
+            raise RuntimeError("Hotels were moved to a normalized storage, which cannot "
+                               "be converted back to wide")
+        if storage != "wide" and (
+            "hotels" in tables or (storage == "changes" and "hotel_daily" in tables)
+        ):
+            raise RuntimeError(
+                f"Hotels are not stored as {storage}, run python schema.py {storage} first"
+            )
+
+    def create_hotels_view(self, storage: str) -> None:
+        """
+        Creates the hotels view of a normalized storage when missing.
+        """
+        if "hotels" in inspect(self.engine).get_view_names():
+            return
+        with self.engine.begin() as connection:
+            connection.execute(text(hotels_view(storage)))
+        print("Create view hotels")
+
+    def set_hotels_storage(self, storage: str) -> None:
+        """
+        Switches hotels to a normalized storage, where hotel_dim holds the
+        static attributes of each hotel and either hotel_daily its daily scores
+        ("normalized") or hotel_scores their change-only history ("changes").
+        The tables of the storage must already exist.\n
+        A hotels table left by the wide storage, or the hotel_daily table when
+        moving from "normalized" to "changes", is converted then dropped, and
+        the hotels view is created over the new tables. The conversion cannot
+        be undone, it is run from the command line only.
+        """
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+            tables = inspector.get_table_names()
+            if "hotels" in tables:
+                source = "hotels"
+            elif storage == "changes" and "hotel_daily" in tables:
+                source = "hotel_daily"
+            elif "hotels" in inspector.get_view_names():
+                return
+            else:
+                source = None
+            if source == "hotels" and storage == "normalized":
+                self._normalize_hotels(connection)
+            elif source is not None:
+                self._replay_hotels(connection)
+            if source == "hotel_daily":
+                connection.execute(text("DROP VIEW hotels"))
+            if source is not None:
+                connection.execute(text(f"DROP TABLE {source}"))
+                print(f"Moved {source} to the {storage} storage")
+            connection.execute(text(hotels_view(storage)))
+            print("Create view hotels")
+
+    def _normalize_hotels(self, connection) -> None:
+        """
+        Splits the hotels table into hotel_dim, with the latest attributes of
+        each hotel, and hotel_daily.
+        """
+        dim = [col.name for col in Base.metadata.tables["hotel_dim"].columns
+               if col.name != "hotel_id"]
+        fact = [col.name for col in Base.metadata.tables["hotel_daily"].columns]
+        days = connection.execute(
+            text("SELECT DISTINCT dt_partition FROM hotels")
+        ).scalars().all()
+        self.ensure_partitions(connection, "hotel_daily", days)
+        connection.execute(text(
+            f"INSERT INTO hotel_dim ({', '.join(dim)}) "
+            f"SELECT {', '.join(f'h.{col}' for col in dim)} FROM hotels h "
+            "JOIN (SELECT name, city, MAX(dt_partition) AS dt_partition "
+            "      FROM hotels WHERE city IS NOT NULL GROUP BY name, city) latest "
+            "ON h.name = latest.name AND h.city = latest.city "
+            "AND h.dt_partition = latest.dt_partition"
+        ))
+        selected = [f"d.{col}" if col == "hotel_id" else f"h.{col}" for col in fact]
+        connection.execute(text(
+            f"INSERT INTO hotel_daily ({', '.join(fact)}) "
+            f"SELECT {', '.join(selected)} FROM hotels h "
+            "JOIN hotel_dim d ON d.name = h.name AND d.city = h.city"
+        ))
+
+    def _replay_hotels(self, connection) -> None:
+        """
+        Loads the daily rows of the hotels table or view one day after the
+        other into the change-only history. Every day lists all the hotels
+        stored then, the hotels missing from a day are closed on it.
+        """
+        load_mode = "copy" if self.enabled else "insert"
+        days = connection.execute(
+            text("SELECT DISTINCT dt_partition FROM hotels ORDER BY dt_partition")
+        ).scalars().all()
+        for day in days:
+            hotels = pd.read_sql(
+                text("SELECT * FROM hotels WHERE dt_partition = :day"),
+                connection, params={"day": str(day)},
+            )
+            load_changes(connection, split_hotels(connection, hotels, load_mode), load_mode)
+            close_missing(connection, day, hotels)
+
+    def migrate(self) -> None:
+        """
+        Converts tables created before partitioning: hotels and weather are
+        rebuilt as partitioned tables with their rows copied over, and the
+        text dt_partition of the rollup tables is turned into a date.
+        """
+        if not self.enabled:
+            return
+        with self.engine.begin() as connection:
+            for table in PARTITIONED_TABLES:
+                if self._relkind(connection, table) != "r":
+                    continue
+                legacy = f"{table}_legacy"
+                connection.execute(text(f'ALTER TABLE "{table}" RENAME TO "{legacy}"'))
+                connection.execute(text(
+                    f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{table}_pkey" TO "{legacy}_pkey"'
+                ))
+                Base.metadata.tables[table].create(connection)
+                self._partitioned[table] = True
+                days = connection.execute(
+                    text(f'SELECT DISTINCT dt_partition::date FROM "{legacy}"')
+                ).scalars().all()
+                self.ensure_partitions(connection, table, days)
+                columns = [col.name for col in Base.metadata.tables[table].columns]
+                selected = [
+                    '"dt_partition"::date' if col == "dt_partition" else f'"{col}"'
+                    for col in columns
+                ]
+                quoted = ", ".join(f'"{col}"' for col in columns)
+                connection.execute(text(
+                    f'INSERT INTO "{table}" ({quoted}) SELECT {", ".join(selected)} FROM "{legacy}"'
+                ))
+                connection.execute(text(f'DROP TABLE "{legacy}"'))
+                print(f"Migrated {table} to daily partitions")
+            for table in DATE_KEYED_TABLES:
+                if self._relkind(connection, table) is None:
+                    continue
+                connection.execute(text(
+                    f'ALTER TABLE "{table}" ALTER COLUMN dt_partition TYPE date '
+                    "USING dt_partition::date"
+                ))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from param import retention_days
+
+    load_dotenv()
+    manager = SchemaManager(create_engine(os.getenv("POSTGRES")), retention_days)
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        manager.migrate()
+    elif command == "retention":
+        manager.apply_retention()
+    elif command in ("normalized", "changes"):
+        stored = "hotel_daily" if command == "normalized" else "hotel_scores"
+        Base.metadata.create_all(manager.engine, tables=[
+            Base.metadata.tables["hotel_dim"], Base.metadata.tables[stored]])
+        manager.set_hotels_storage(command)
+    else:
+        print("Usage: python schema.py [migrate|retention|normalized|changes]")
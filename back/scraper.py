@@ -1,9 +1,28 @@
 
+import os
+import json
+import shutil
+import hashlib
 import logging
+import multiprocessing
 import scrapy
 from typing import Type
+from urllib.parse import urlsplit
 from scrapy.crawler import CrawlerProcess
-from big_data import AwsInstance
+from big_data import get_aws
+from fingerprint import FingerprintStore
+from extractor import HotelExtractor, DEFAULT_SELECTORS
+from metrics import metrics
+
+# base url of the crawled site, pointed to a local server by the offline benchmark
+BOOKING_URL = os.getenv('BOOKING_URL', 'https://www.booking.com')
+# Scrapy stats reported as metrics of the crawl
+CRAWL_STATS = {
+    'item_scraped_count': 'crawl_items',
+    'downloader/request_count': 'crawl_requests',
+    'downloader/response_bytes': 'crawl_bytes',
+    'downloader/response_status_count/304': 'crawl_not_modified',
+}
 
 
 class HotelSpider(scrapy.Spider):
@@ -14,14 +33,39 @@ class HotelSpider(scrapy.Spider):
     '''
     name='hotelspider'
 
-    def __init__(self, cities):
+    def __init__(self, cities, incremental: bool=False, fingerprint_db: str='fingerprints.db',
+                 full_refresh: int=7 * 24 * 3600, selectors: str=DEFAULT_SELECTORS):
         '''
         Initializes the HotelSpider class.\n
         Args:
             cities (list): A list of cities to scrape hotel information for.
+            incremental (bool, optional): Only emit hotels whose page changed, loadable
+                in the 'changes' hotels storage only. Defaults to False.
+            fingerprint_db (str, optional): Path of the pages fingerprint store.
+            full_refresh (int, optional): Seconds after which every hotel is emitted again.
+            selectors (str, optional): Path of the hotel page selector config.
         '''
         super().__init__()
         self.cities = cities
+        self.extractor = HotelExtractor(selectors)
+        self.incremental = incremental
+        self.fingerprints = FingerprintStore(fingerprint_db, full_refresh) if incremental else None
+
+    @staticmethod
+    def _page_key(url: str) -> str:
+        '''
+        Keys a hotel page by its path, the query string holds tracking parameters.
+        '''
+        return urlsplit(url).path
+
+    @staticmethod
+    def _item_hash(item: dict) -> str:
+        '''
+        Hashes the extracted fields of a hotel, the raw page embeds per request
+        tokens and never hashes the same twice.
+        '''
+        content = {k: v for k, v in item.items() if k != 'url'}
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
 
     def start_requests(self):
         '''
@@ -31,7 +75,7 @@ class HotelSpider(scrapy.Spider):
         '''
         for city in self.cities:
             city = city.replace(' ','-')
-            url = f'https://www.booking.com/city/fr/{city}.fr.html'
+            url = f'{BOOKING_URL}/city/fr/{city}.fr.html'
             yield scrapy.Request(url=url, callback=self.parse, meta={'city':city})
 
     def parse(self, response):
@@ -42,10 +86,16 @@ class HotelSpider(scrapy.Spider):
         Yields:
             scrapy.Request: The request to scrape hotel details.
         '''
+        metrics.observe('crawl_request', response.meta.get('download_latency', 0), page='city')
         hrefs = response.xpath('//div[@class="c6666c448e"]/a/@href').getall()
         city = response.meta.get('city')
         for href in hrefs:
-            yield response.follow(href, callback=self.parse_hotel_details, meta={'url': href, 'city':city})
+            meta = {'url': href, 'city':city}
+            headers = {}
+            if self.incremental:
+                headers = self.fingerprints.conditional_headers(self._page_key(href))
+                meta['handle_httpstatus_list'] = [304]
+            yield response.follow(href, callback=self.parse_hotel_details, meta=meta, headers=headers)
 
 
     def parse_hotel_details(self, response):
@@ -54,30 +104,147 @@ class HotelSpider(scrapy.Spider):
         Args:
             response (scrapy.http.Response): The response from the hotel details page.\n
         Yields:
-            dict: A dictionary containing hotel information.
+            dict: A dictionary containing hotel information, in incremental mode
+            only when it changed since the last crawl.
         '''
-        name = response.css('h2.d2fee87262.pp-header__title::text').get()
-        rating = response.css('p.review_score_value::text').get()
-        description = response.xpath('/html/body/div[3]/div/div[5]/div[1]/div[1]/div[3]/div/div/div[1]/div[1]/div[1]/div[1]/div[2]/div/p/text()').get()
-        reviews = response.css('a.big_review_score_detailed div.abf093bdfe::text').get()
-        coordinates = response.css('a#hotel_sidebar_static_map::attr(data-atlas-latlng)').get()
+        metrics.observe('crawl_request', response.meta.get('download_latency', 0), page='hotel')
+        if response.status == 304:
+            self.fingerprints.touch(self._page_key(response.meta.get('url')))
+            return
+        fields, special_rate = self.extractor.extract(response.body, response.encoding)
         url = response.meta.get('url')
         city = response.meta.get('city')
-    
-        
-        review_elements = response.css('div[data-testid="review-subscore"]')
-
-        special_rate = {review.css('span.be887614c2::text').get(): review.css('div.ccb65902b2.efcd70b4c4::text').get() for review in review_elements}
-        yield {
-            'name': name,
+        item = {
+            'name': fields.pop('name', None),
             'city': city,
-            'rating': rating,
-            'description': description,
-            'reviews': reviews,
-            'coordinates': coordinates,
+            **fields,
             'url': url,
             **special_rate
         }
+        if self.incremental and not self._has_changed(response, item):
+            metrics.count('crawl_unchanged')
+            return
+        yield item
+
+    def _has_changed(self, response, item: dict) -> bool:
+        '''
+        Compares a hotel with its stored fingerprint and records the new one.\n
+        Args:
+            response (scrapy.http.Response): The response from the hotel details page.
+            item (dict): The extracted hotel.\n
+        Returns:
+            bool: True when the hotel must be emitted, either because it changed
+            or because it is due for a full refresh.
+        '''
+        key = self._page_key(response.meta.get('url'))
+        content_hash = self._item_hash(item)
+        fingerprint = self.fingerprints.get(key)
+        changed = (not self.fingerprints.is_fresh(fingerprint)
+                   or fingerprint['content_hash'] != content_hash)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        self.fingerprints.update(key, etag and etag.decode('latin-1'),
+                                 last_modified and last_modified.decode('latin-1'),
+                                 content_hash, changed)
+        return changed
+
+    def closed(self, reason):
+        if self.fingerprints is not None:
+            self.fingerprints.close()
+
+
+def feed_options(filename: str) -> dict:
+    '''
+    Builds the Scrapy feed options matching the extension of the output file.\n
+    Args:
+        filename (str): The name of the feed file, .json, .jsonl or .jsonl.gz.\n
+    Returns:
+        dict: The feed options.
+    '''
+    if '.jsonl' not in filename:
+        return {'format': 'json', 'overwrite': True}
+    options = {'format': 'jsonlines', 'overwrite': True}
+    if filename.endswith('.gz'):
+        options['postprocessing'] = ['scrapy.extensions.postprocessing.GzipPlugin']
+    return options
+
+
+def run_crawl(Spider: Type[scrapy.Spider], cities: list, filename: str,
+              settings: dict=None, spider_kwargs: dict=None, metrics_path: str=None,
+              profile: tuple=None) -> None:
+    '''
+    Runs a blocking crawling process writing the scraped items to a feed file.\n
+    Args:
+        Spider (Type[scrapy.Spider]): The spider class to run.
+        cities (list): The cities handed to the spider.
+        filename (str): The name of the feed file.
+        settings (dict, optional): Extra Scrapy settings such as CONCURRENT_REQUESTS.
+        spider_kwargs (dict, optional): Extra keyword arguments of the spider.
+        metrics_path (str, optional): File receiving the metrics of the crawl, used
+            by shards whose metrics are lost with their process otherwise.
+        profile (tuple, optional): Profiled steps and profile directory, as in
+            metrics.configure, which a spawned shard does not inherit.\n
+    Raises:
+        RuntimeError: When hotels streamed by the HotelLoadPipeline failed to load.
+    '''
+    process = CrawlerProcess(settings={
+        'USER_AGENT': 'Mozilla/5.0',
+        'LOG_LEVEL': logging.INFO,
+        "FEEDS": {
+            filename: feed_options(filename),
+        },
+        **(settings or {}),
+    })
+
+    if profile:
+        metrics.configure(*profile)
+    crawler = process.create_crawler(Spider)
+    process.crawl(crawler, cities=cities, **(spider_kwargs or {}))
+    with metrics.timer('crawl', spider=Spider.name):
+        process.start()
+    stats = crawler.stats.get_stats()
+    for key, name in CRAWL_STATS.items():
+        metrics.count(name, stats.get(key, 0))
+    if metrics_path:
+        with open(metrics_path, 'w', encoding='utf-8') as file:
+            json.dump(metrics.report(), file)
+    if stats.get('kayak/failed_hotels'):
+        raise RuntimeError(f'{stats["kayak/failed_hotels"]} crawled hotels failed to load')
+
+
+def shard_filename(filename: str, shard: int) -> str:
+    '''
+    Names the feed file of a shard, bookings_hotels.jsonl.gz -> bookings_hotels.shard0.jsonl.gz
+    '''
+    directory, name = os.path.split(filename)
+    base, _, extension = name.partition('.')
+    return os.path.join(directory, f'{base}.shard{shard}.{extension}')
+
+
+def merge_feeds(parts: list, filename: str) -> None:
+    '''
+    Merges shard feed files into a single feed and removes the shards.\n
+    JSON Lines files, compressed or not, are concatenated byte for byte since
+    gzip members can follow each other. JSON arrays are parsed and re-dumped.\n
+    Args:
+        parts (list): The shard feed files, missing ones are ignored.
+        filename (str): The merged feed file.
+    '''
+    parts = [part for part in parts if os.path.exists(part)]
+    if '.jsonl' in filename:
+        with open(filename, 'wb') as merged:
+            for part in parts:
+                with open(part, 'rb') as file:
+                    shutil.copyfileobj(file, merged)
+    else:
+        items = []
+        for part in parts:
+            with open(part, 'r', encoding='utf-8') as file:
+                items.extend(json.load(file))
+        with open(filename, 'w', encoding='utf-8') as merged:
+            json.dump(items, merged)
+    for part in parts:
+        os.remove(part)
 
 
 class Crawler():
@@ -85,15 +252,33 @@ class Crawler():
     A class for initiating a crawling process to scrape hotel information and save it to AWS S3.\n
     Attributes:
         spider: An instance of the spider used for crawling.
-        aws (AwsInstance): An instance of the AwsInstance class.
     '''
 
-    def __init__(self, Spider: Type[scrapy.Spider], cities: list, filename: str):
+    def __init__(self, Spider: Type[scrapy.Spider], cities: list, filename: str,
+                 shards: int=1, settings: dict=None, subprocess: bool=False,
+                 **spider_kwargs):
+        '''
+        Args:
+            Spider (Type[scrapy.Spider]): The spider class to run.
+            cities (list): The cities to crawl.
+            filename (str): The name of the feed file.
+            shards (int, optional): Number of worker processes sharing the cities. Defaults to 1.
+            settings (dict, optional): Scrapy settings applied to every shard, concurrency
+                and autothrottle limits are therefore per shard.
+            subprocess (bool, optional): Run a single shard in a child process too, as
+                the Twisted reactor can only run in the main thread. Defaults to False.
+            spider_kwargs: Extra keyword arguments of the spider.
+        '''
         self.spider = Spider
         self.cities = cities
         self.filename = filename
-        self.aws = AwsInstance()
-        self._crawl_booking(filename)
+        self.shards = max(1, min(shards, len(cities)))
+        self.settings = settings or {}
+        self.spider_kwargs = spider_kwargs
+        if self.shards == 1 and not subprocess:
+            self._crawl_booking(filename)
+        else:
+            self._crawl_sharded(filename)
 
     def _crawl_booking(self, filename: str):
         '''
@@ -103,34 +288,79 @@ class Crawler():
         Returns:
             None
         '''
-        process = CrawlerProcess(settings={
-            'USER_AGENT': 'Mozilla/5.0',
-            'LOG_LEVEL': logging.INFO,
-            "FEEDS": {
-                filename: {"format": "json"},
-            }
-        })
+        run_crawl(self.spider, self.cities, filename, self.settings, self.spider_kwargs)
 
-        process.crawl(self.spider, cities=self.cities)
-        process.start()
+    def _crawl_sharded(self, filename: str):
+        '''
+        Splits the cities across worker processes, each running its own reactor
+        and feed file, then merges the shard feeds into filename.\n
+        Args:
+            filename (str): The name of the file to save the scraped data.\n
+        Returns:
+            None
+        Raises:
+            RuntimeError: When a shard failed, its cities would be missing from
+                the feed. The feeds of every shard are removed first so a retry
+                does not append to them.
+        '''
+        context = multiprocessing.get_context('spawn')
+        workers = []
+        for shard in range(self.shards):
+            part = shard_filename(filename, shard)
+            worker = context.Process(
+                target=run_crawl,
+                args=(self.spider, self.cities[shard::self.shards], part,
+                      self.settings, self.spider_kwargs, f'{part}.metrics.json',
+                      (sorted(metrics.profile), metrics.profile_dir)),
+                name=f'crawl-shard{shard}',
+            )
+            worker.start()
+            workers.append((worker, part))
+        failed = []
+        for worker, part in workers:
+            worker.join()
+            if worker.exitcode != 0:
+                logging.error(f'{worker.name} exited with code {worker.exitcode}')
+                failed.append(worker.name)
+            if os.path.exists(f'{part}.metrics.json'):
+                with open(f'{part}.metrics.json', 'r', encoding='utf-8') as file:
+                    metrics.merge(json.load(file))
+                os.remove(f'{part}.metrics.json')
+        if failed:
+            for _, part in workers:
+                if os.path.exists(part):
+                    os.remove(part)
+            raise RuntimeError(f'Crawl shards failed: {", ".join(failed)}')
+        merge_feeds([part for _, part in workers], filename)
 
-    def load_cloud_files(self, mode: str='latest') -> None:
+    def load_cloud_files(self, mode: str='latest', prefix: str='', start: str=None,
+                         end: str=None, workers: int=8) -> None:
         '''
         Downloads files from an Amazon S3 bucket to a local directory.\n
         Args:
             mode (str, optional): The mode of downloading. Defaults to 'latest'.\n
                 - 'latest': Downloads only the latest uploaded file.
                 - 'all': Downloads all files uploaded to the bucket.
+                - 'sync': Lists the bucket and downloads in parallel every file
+                  missing locally, including ones absent from s3_files.log.
+            prefix (str, optional): Key prefix of the files to sync.
+            start (str, optional): First upload date to sync, YYYY-MM-DD.
+            end (str, optional): Last upload date to sync, YYYY-MM-DD.
+            workers (int, optional): Number of parallel downloads when syncing.
         '''
         dir_ = 'hotels'
+        aws = get_aws()
         if mode == 'latest':
             with open('s3_files.log', 'r', encoding='UTF-8') as file:
                 for s3_upload in file:
                     last_uploaded = s3_upload.strip()
-            self.aws.load_from_s3(last_uploaded, dir_)
+            aws.load_from_s3(last_uploaded, dir_)
 
         if mode == 'all':
             with open('s3_files.log', 'r', encoding='UTF-8') as file:
                 uploaded_files = [line.strip() for line in file]
             for upload in uploaded_files:
-                self.aws.load_from_s3(upload, dir_)
+                aws.load_from_s3(upload, dir_)
+
+        if mode == 'sync':
+            aws.sync(dir_, prefix=prefix, start=start, end=end, workers=workers)
@@ -0,0 +1,122 @@
+import os
+import shutil
+import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from sqlalchemy import text
+
+LATEST = "LATEST"
+# hotels of the latest partition of each city, as shown by the city pages
+HOTELS_LATEST = """
+SELECT hotels.* FROM hotels
+JOIN (SELECT city, MAX(dt_partition) AS dt_partition
+      FROM city_rating_daily GROUP BY city) latest
+  ON hotels.city = latest.city AND hotels.dt_partition = latest.dt_partition
+"""
+# forecasts made on the latest day, as shown by default on the weather page
+WEATHER_LATEST = """
+SELECT * FROM weather WHERE dt_partition = (SELECT MAX(dt_partition) FROM weather)
+"""
+# full resolution forecast and its daily rollup fetched along that same day
+FORECAST_LATEST = """
+SELECT * FROM {table} WHERE dt_partition = (SELECT MAX(dt_partition) FROM weather)
+"""
+RATING_DISTRIBUTION = """
+SELECT city, MIN(rating) AS lowerfence,
+       percentile_cont(0.25) WITHIN GROUP (ORDER BY rating) AS q1,
+       percentile_cont(0.5) WITHIN GROUP (ORDER BY rating) AS median,
+       percentile_cont(0.75) WITHIN GROUP (ORDER BY rating) AS q3,
+       MAX(rating) AS upperfence
+FROM hotels GROUP BY city ORDER BY median
+"""
+
+
+def rating_distribution(connection) -> pd.DataFrame:
+    """
+    Computes the rating quartiles of each city over every day, in SQL on
+    PostgreSQL and in pandas on databases without percentile_cont.
+    """
+    if connection.dialect.name == "postgresql":
+        return pd.read_sql(text(RATING_DISTRIBUTION), connection)
+    ratings = pd.read_sql(text("SELECT city, rating FROM hotels"), connection)
+    grouped = ratings.groupby("city")["rating"]
+    distribution = pd.DataFrame({
+        "lowerfence": grouped.min(),
+        "q1": grouped.quantile(0.25),
+        "median": grouped.median(),
+        "q3": grouped.quantile(0.75),
+        "upperfence": grouped.max(),
+    }).reset_index()
+    return distribution.sort_values("median", ignore_index=True)
+
+
+def dashboard_frames(engine) -> dict:
+    """
+    Reads the dataset the front loads when a session starts.\n
+    Args:
+        engine (sqlalchemy.Engine): Engine connected to the Kayak database.
+    Returns:
+        dict: city_rating_daily, weather_city_daily with the city coordinates
+        merged in, hotels_latest, weather_latest, weather_forecast_latest,
+        weather_forecast_daily_latest and rating_distribution frames.
+    """
+    with engine.connect() as connection:
+        city_rating = pd.read_sql(text("SELECT * FROM city_rating_daily"), connection)
+        weather_city = pd.read_sql(text("SELECT * FROM weather_city_daily"), connection)
+        hotels = pd.read_sql(text(HOTELS_LATEST), connection)
+        weather = pd.read_sql(text(WEATHER_LATEST), connection)
+        forecast = pd.read_sql(
+            text(FORECAST_LATEST.format(table="weather_forecast")), connection)
+        forecast_daily = pd.read_sql(
+            text(FORECAST_LATEST.format(table="weather_forecast_daily")), connection)
+        distribution = rating_distribution(connection)
+    geo = city_rating.sort_values("dt_partition").drop_duplicates(subset="city", keep="last")
+    geo = geo[["city", "lat", "lon"]]
+    # the spider stores city names with dashes instead of spaces
+    geo = geo.assign(city=geo["city"].str.replace("-", " "))
+    weather_city = weather_city.merge(geo, on="city", how="left")
+    return {
+        "city_rating_daily": city_rating,
+        "weather_city_daily": weather_city,
+        "hotels_latest": hotels,
+        "weather_latest": weather,
+        "weather_forecast_latest": forecast,
+        "weather_forecast_daily_latest": forecast_daily,
+        "rating_distribution": distribution,
+    }
+
+
+def write_snapshot(engine, directory: str, keep: int = 3) -> str:
+    """
+    Writes the dashboard dataset as uncompressed Arrow IPC (Feather v2) files,
+    which the front memory-maps instead of querying the database.\n
+    Each snapshot gets its own version directory, and the LATEST file naming
+    the current one is swapped atomically once every file is written, so a
+    reader never sees a partial snapshot.\n
+    Args:
+        engine (sqlalchemy.Engine): Engine connected to the Kayak database.
+        directory (str): Directory holding the snapshots, shared with the front.
+        keep (int, optional): Number of versions kept, older ones are removed.
+            Defaults to 3.
+    Returns:
+        str: The version of the snapshot.
+    """
+    version = datetime.datetime.now().strftime("v%Y%m%d%H%M%S%f")
+    target = os.path.join(directory, version)
+    os.makedirs(target)
+    for name, df in dashboard_frames(engine).items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        feather.write_feather(table, os.path.join(target, f"{name}.arrow"),
+                              compression="uncompressed")
+    latest = os.path.join(directory, LATEST)
+    with open(f"{latest}.tmp", "w", encoding="utf-8") as file:
+        file.write(version)
+    os.replace(f"{latest}.tmp", latest)
+    print(f"Snapshot {version} written to {directory}")
+
+    versions = sorted(name for name in os.listdir(directory) if name.startswith("v"))
+    # removed files stay readable through the memory maps already open on them
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return version
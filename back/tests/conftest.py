@@ -0,0 +1,44 @@
+import os
+import sys
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+# the modules of back import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_models import Base  # noqa: E402
+
+HOTEL_COLUMNS = [col.name for col in Base.metadata.tables["hotels"].columns]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """
+    SQLite database holding the change-only storage of the hotels.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'kayak.db'}")
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables["hotel_dim"],
+                                             Base.metadata.tables["hotel_scores"]])
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def make_hotels():
+    """
+    Builds cleaned hotels of a day, matching the HotelsTable schema, from
+    (name, city, rating) tuples. The other scores are derived from the rating.
+    """
+    def make(day: str, *hotels) -> pd.DataFrame:
+        rows = []
+        for name, city, rating in hotels:
+            rows.append({
+                "name": name, "city": city, "rating": rating,
+                "description": "Fabuleux", "reviews": 100, "url": f"https://kayak.test/{name}",
+                "personnel": rating, "equipments": rating, "property": rating,
+                "comfort": rating, "value": rating, "location": rating, "wifi": rating,
+                "lat": 48.85, "lon": 2.35, "dt_partition": day,
+            })
+        return pd.DataFrame(rows, columns=HOTEL_COLUMNS)
+    return make
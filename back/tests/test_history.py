@@ -0,0 +1,97 @@
+import pandas as pd
+from sqlalchemy import text
+from dimension import read_dim, split_hotels
+from history import as_of, close_missing, load_changes
+
+
+def load(engine, hotels: pd.DataFrame, complete: bool = False) -> int:
+    with engine.begin() as connection:
+        written = load_changes(connection, split_hotels(connection, hotels, "insert"), "insert")
+        if complete:
+            close_missing(connection, hotels["dt_partition"].iloc[0], hotels)
+    return written
+
+
+def versions(engine) -> list:
+    with engine.connect() as connection:
+        return connection.execute(text(
+            "SELECT d.name, s.valid_from, s.valid_to, s.rating FROM hotel_scores s "
+            "JOIN hotel_dim d ON d.hotel_id = s.hotel_id ORDER BY d.name, s.valid_from"
+        )).all()
+
+
+def ratings(engine, day: str) -> dict:
+    with engine.connect() as connection:
+        hotels = as_of(connection, day)
+    return dict(zip(hotels["name"], hotels["rating"]))
+
+
+def test_unchanged_hotel_keeps_its_version(engine, make_hotels):
+    assert load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 9.1))) == 1
+    assert load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 9.1))) == 0
+    assert versions(engine) == [("Ritz", "2026-10-16", None, 9.1)]
+    assert ratings(engine, "2026-10-17") == {"Ritz": 9.1}
+
+
+def test_changed_hotel_opens_a_version(engine, make_hotels):
+    load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 9.1)))
+    assert load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 8.7))) == 1
+    assert versions(engine) == [("Ritz", "2026-10-16", "2026-10-17", 9.1),
+                                ("Ritz", "2026-10-17", None, 8.7)]
+    assert ratings(engine, "2026-10-16") == {"Ritz": 9.1}
+    assert ratings(engine, "2026-10-18") == {"Ritz": 8.7}
+
+
+def test_reloaded_day_replaces_its_version(engine, make_hotels):
+    load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 9.1)))
+    load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 8.7)))
+    load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 8.9)))
+    assert versions(engine) == [("Ritz", "2026-10-16", "2026-10-17", 9.1),
+                                ("Ritz", "2026-10-17", None, 8.9)]
+
+
+def test_late_rows_are_skipped(engine, make_hotels, capsys):
+    load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 9.1)))
+    assert load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 7.0))) == 0
+    assert versions(engine) == [("Ritz", "2026-10-17", None, 9.1)]
+    assert "Skipped 1 rows older than the current version" in capsys.readouterr().out
+
+
+def test_late_rows_of_a_closed_hotel_are_skipped(engine, make_hotels):
+    load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 9.1), ("Crillon", "Paris", 9.4)),
+         complete=True)
+    load(engine, make_hotels("2026-10-17", ("Crillon", "Paris", 9.4)), complete=True)
+    assert load(engine, make_hotels("2026-10-15", ("Ritz", "Paris", 7.0))) == 0
+    assert ratings(engine, "2026-10-15") == {}
+
+
+def test_missing_hotels_are_closed_after_a_complete_load(engine, make_hotels):
+    load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 9.1), ("Crillon", "Paris", 9.4),
+                             ("Royal", "Lyon", 8.2)), complete=True)
+    # Lyon is not part of the second load, its hotels stay open
+    load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 9.1)), complete=True)
+    assert ratings(engine, "2026-10-16") == {"Crillon": 9.4, "Ritz": 9.1, "Royal": 8.2}
+    assert ratings(engine, "2026-10-17") == {"Ritz": 9.1, "Royal": 8.2}
+    # back on the listings the next day
+    load(engine, make_hotels("2026-10-18", ("Ritz", "Paris", 9.1), ("Crillon", "Paris", 9.4)),
+         complete=True)
+    assert ratings(engine, "2026-10-18") == {"Crillon": 9.4, "Ritz": 9.1, "Royal": 8.2}
+
+
+def test_missing_hotels_opened_the_same_day_are_removed(engine, make_hotels):
+    load(engine, make_hotels("2026-10-16", ("Ritz", "Paris", 9.1)), complete=True)
+    load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 8.7), ("Crillon", "Paris", 9.4)),
+         complete=True)
+    load(engine, make_hotels("2026-10-17", ("Ritz", "Paris", 8.7)), complete=True)
+    assert versions(engine) == [("Ritz", "2026-10-16", "2026-10-17", 9.1),
+                                ("Ritz", "2026-10-17", None, 8.7)]
+
+
+def test_same_name_in_two_cities_are_two_hotels(engine, make_hotels):
+    load(engine, make_hotels("2026-10-16", ("Ibis", "Paris", 7.5), ("Ibis", "Lyon", 8.0)))
+    with engine.connect() as connection:
+        dim = read_dim(connection)
+        paris = as_of(connection, "2026-10-16", city="Paris")
+    assert sorted(dim["city"]) == ["Lyon", "Paris"]
+    assert dim["hotel_id"].nunique() == 2
+    assert paris["rating"].tolist() == [7.5]
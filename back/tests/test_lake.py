@@ -0,0 +1,30 @@
+from data_models import CityRatingDaily, EtlStateTable, HotelsTable
+from etl import Kayak, clean_hotels
+from lake import DataLake
+
+
+def raw_hotels(make_hotels, *hotels):
+    # raw items as yielded by the spider, before clean_hotels
+    raw = make_hotels("2026-10-18", *hotels).drop(columns=["lat", "lon", "dt_partition"])
+    return raw.assign(reviews="100 expériences vécues", coordinates="48.85,2.35",
+                      rating=raw["rating"].map(lambda rating: str(rating).replace(".", ",")))
+
+
+def test_chunked_rerun_replaces_the_day(tmp_path, monkeypatch, make_hotels):
+    monkeypatch.setenv("POSTGRES", f"sqlite:///{tmp_path / 'kayak.db'}")
+    kayak = Kayak({"hotels": HotelsTable(), "etl_state": EtlStateTable(),
+                   "city_rating_daily": CityRatingDaily()},
+                  sources={}, run=False, lake=DataLake(str(tmp_path / "lake")))
+    raw = raw_hotels(make_hotels, ("Ritz", "Paris", 9.1), ("Royal", "Lyon", 8.2),
+                     ("Ibis", "Nice", 7.5))
+
+    def load(chunks):
+        monkeypatch.setattr(kayak, "_read_chunks", lambda key: iter(chunks))
+        for _ in kayak._clean_chunks("hotels", clean_hotels, "2026-10-18"):
+            pass
+
+    # Nice first appears in the second chunk of each run
+    load([raw.iloc[:2], raw.iloc[2:]])
+    load([raw.iloc[:1], raw.iloc[1:]])
+    assert sorted(kayak.lake.read("hotels")["name"]) == ["Ibis", "Ritz", "Royal"]
+    assert len(kayak.lake.read("raw/hotels")) == 3
@@ -0,0 +1,31 @@
+from sqlalchemy import text
+from data_models import CityRatingDaily, EtlStateTable, HotelsTable
+from etl import Kayak
+
+TABLES = {"hotels": HotelsTable(), "etl_state": EtlStateTable(),
+          "city_rating_daily": CityRatingDaily()}
+
+
+def city_ratings(engine) -> list:
+    with engine.connect() as connection:
+        return connection.execute(text(
+            "SELECT dt_partition, city, hotels FROM city_rating_daily ORDER BY dt_partition, city"
+        )).all()
+
+
+def test_empty_rollups_are_backfilled(tmp_path, monkeypatch, make_hotels, capsys):
+    monkeypatch.setenv("POSTGRES", f"sqlite:///{tmp_path / 'kayak.db'}")
+    kayak = Kayak(TABLES, sources={}, run=False)
+    kayak.load_hotels(make_hotels("2026-10-16", ("Ritz", "Paris", 9.1), ("Royal", "Lyon", 8.2)))
+    kayak.load_hotels(make_hotels("2026-10-17", ("Ritz", "Paris", 8.7)))
+    loaded = city_ratings(kayak.engine)
+    # a database loaded before the rollups existed
+    with kayak.engine.begin() as connection:
+        connection.execute(text("DELETE FROM city_rating_daily"))
+    capsys.readouterr()
+    kayak = Kayak(TABLES, sources={}, run=False)
+    assert city_ratings(kayak.engine) == loaded
+    assert "Backfilled city_rating_daily from hotels" in capsys.readouterr().out
+    # filled rollups are left alone
+    Kayak(TABLES, sources={}, run=False)
+    assert "Backfilled" not in capsys.readouterr().out
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import inspect, text
+from data_models import Base, CityRatingDaily, EtlStateTable, HotelsTable
+from etl import Kayak
+from schema import SchemaManager
+
+
+def hotels(engine) -> list:
+    with engine.connect() as connection:
+        return connection.execute(text(
+            "SELECT name, city, rating, dt_partition FROM hotels ORDER BY dt_partition, name"
+        )).all()
+
+
+def convert(engine, storage: str) -> None:
+    # as run by python schema.py normalized|changes
+    stored = "hotel_daily" if storage == "normalized" else "hotel_scores"
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables["hotel_dim"],
+                                             Base.metadata.tables[stored]])
+    SchemaManager(engine).set_hotels_storage(storage)
+
+
+@pytest.fixture
+def wide(tmp_path, monkeypatch, make_hotels):
+    """
+    Kayak storing two days of hotels in the wide hotels table of SQLite.
+    """
+    monkeypatch.setenv("POSTGRES", f"sqlite:///{tmp_path / 'kayak.db'}")
+    tables = {"hotels": HotelsTable(), "etl_state": EtlStateTable(),
+              "city_rating_daily": CityRatingDaily()}
+    kayak = Kayak(tables, sources={}, run=False)
+    kayak.load_hotels(make_hotels("2026-10-16", ("Ritz", "Paris", 9.1),
+                                  ("Crillon", "Paris", 9.4), ("Royal", "Lyon", 8.2)))
+    # Crillon is delisted, Royal and Ritz change, Ibis is new
+    kayak.load_hotels(make_hotels("2026-10-17", ("Ritz", "Paris", 8.7),
+                                  ("Royal", "Lyon", 8.2), ("Ibis", "Lyon", 7.5)))
+    yield kayak
+    kayak.engine.dispose()
+
+
+def test_wide_to_normalized_to_changes(wide):
+    rows = hotels(wide.engine)
+    assert len(rows) == 6
+    convert(wide.engine, "normalized")
+    inspector = inspect(wide.engine)
+    assert "hotels" in inspector.get_view_names()
+    assert "hotels" not in inspector.get_table_names()
+    assert hotels(wide.engine) == rows
+    convert(wide.engine, "changes")
+    inspector = inspect(wide.engine)
+    assert "hotel_daily" not in inspector.get_table_names()
+    assert hotels(wide.engine) == rows
+    with wide.engine.connect() as connection:
+        # Royal did not change, it keeps its first version
+        assert connection.execute(text("SELECT COUNT(*) FROM hotel_scores")).scalar() == 5
+
+
+def test_wide_to_changes(wide):
+    rows = hotels(wide.engine)
+    convert(wide.engine, "changes")
+    assert hotels(wide.engine) == rows
+
+
+def test_storage_is_checked_against_the_database(wide):
+    with pytest.raises(RuntimeError, match="schema.py changes"):
+        wide.schema.check_hotels_storage("changes")
+    convert(wide.engine, "normalized")
+    with pytest.raises(RuntimeError):
+        wide.schema.check_hotels_storage("wide")
+    wide.schema.check_hotels_storage("normalized")
+
+
+def test_converted_storage_keeps_loading(wide, make_hotels):
+    convert(wide.engine, "changes")
+    tables = {"etl_state": EtlStateTable(), "city_rating_daily": CityRatingDaily()}
+    kayak = Kayak(tables, sources={}, hotels_storage="changes", run=False)
+    kayak.load_hotels(make_hotels("2026-10-18", ("Ritz", "Paris", 8.7),
+                                  ("Royal", "Lyon", 8.4), ("Ibis", "Lyon", 7.5)))
+    kayak.close_missing_hotels(make_hotels("2026-10-18", ("Ritz", "Paris", 8.7),
+                                           ("Royal", "Lyon", 8.4), ("Ibis", "Lyon", 7.5)))
+    assert [row for row in hotels(kayak.engine) if row[3] == "2026-10-18"] == [
+        ("Ibis", "Lyon", 7.5, "2026-10-18"),
+        ("Ritz", "Paris", 8.7, "2026-10-18"),
+        ("Royal", "Lyon", 8.4, "2026-10-18"),
+    ]
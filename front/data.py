@@ -0,0 +1,201 @@
+import os
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import streamlit as st
+from sqlalchemy import create_engine, text
+
+# seconds between two checks for data landed by the ETL
+VERSION_TTL = int(os.getenv("CACHE_VERSION_TTL", 60))
+DATA_TTL = 24 * 3600
+# Arrow snapshots written by the ETL, the database is queried when unset
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_FRAMES = ["city_rating_daily", "weather_city_daily", "hotels_latest",
+                   "weather_latest", "weather_forecast_latest",
+                   "weather_forecast_daily_latest", "rating_distribution"]
+
+
+def partition_as_text(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Formats the dt_partition dates as YYYY-MM-DD strings, as compared in the front.
+    """
+    df["dt_partition"] = df["dt_partition"].astype(str)
+    return df
+
+
+@st.cache_resource
+def get_engine():
+    return create_engine(os.getenv("POSTGRES"))
+
+
+def with_coordinates(city_rating: pd.DataFrame, weather_city: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the latest coordinates of each city to the weather rollup, as done by
+    the ETL when writing a snapshot.
+    """
+    geo = city_rating.sort_values("dt_partition").drop_duplicates(subset="city", keep="last")
+    geo = geo[["city", "lat", "lon"]]
+    # the spider stores city names with dashes instead of spaces
+    geo = geo.assign(city=geo["city"].str.replace("-", " "))
+    return weather_city.merge(geo, on="city", how="left")
+
+
+def snapshot_version() -> str:
+    """
+    Reads the version of the latest snapshot, None without snapshot.\n
+    The LATEST file is swapped atomically by the ETL once a snapshot is
+    complete, reading it costs a single small file read per rerun.
+    """
+    if not SNAPSHOT_DIR:
+        return None
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, "LATEST"), encoding="utf-8") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+@st.cache_resource(max_entries=1)
+def load_snapshot(version: str) -> dict:
+    """
+    Memory-maps the Arrow files of a snapshot.\n
+    The tables point into the page cache, shared by every session and by the
+    other processes reading the same files, nothing is copied until a slice is
+    converted to pandas. Keeping a single entry releases the previous version
+    once a new one lands.\n
+    Returns:
+        dict: The Arrow tables of the snapshot, by name. Frames missing from
+        snapshots written by an older ETL are left out.
+    """
+    directory = os.path.join(SNAPSHOT_DIR, version)
+    paths = {name: os.path.join(directory, f"{name}.arrow") for name in SNAPSHOT_FRAMES}
+    return {
+        name: feather.read_table(path, memory_map=True)
+        for name, path in paths.items() if os.path.exists(path)
+    }
+
+
+def snapshot() -> dict:
+    """
+    Returns the tables of the latest snapshot, None without snapshot.
+    """
+    version = snapshot_version()
+    return load_snapshot(version) if version else None
+
+
+def snapshot_frame(name: str) -> pd.DataFrame:
+    """
+    Converts a whole frame of the latest snapshot, None without it.
+    """
+    tables = snapshot()
+    if tables is None or name not in tables:
+        return None
+    return tables[name].to_pandas()
+
+
+def _snapshot_city(name: str, city: str, dt_partition: str) -> pd.DataFrame:
+    tables = snapshot()
+    if tables is None or name not in tables:
+        return None
+    rows = tables[name]
+    rows = rows.filter(pc.equal(rows["city"], city))
+    if rows.num_rows == 0:
+        return None
+    rows = partition_as_text(rows.to_pandas())
+    if rows["dt_partition"].iloc[0] != dt_partition:
+        return None
+    return rows
+
+
+def snapshot_hotels(city: str, dt_partition: str) -> pd.DataFrame:
+    """
+    Filters the hotels of a city out of the latest snapshot, None when the
+    snapshot does not hold that day of the city.
+    """
+    hotels = _snapshot_city("hotels_latest", city, dt_partition)
+    if hotels is None:
+        return None
+    return hotels.sort_values("name", ignore_index=True)
+
+
+def snapshot_weather(city: str, dt_partition: str) -> pd.DataFrame:
+    """
+    Filters the forecasts of a city out of the latest snapshot, None when the
+    snapshot does not hold that day of the city.
+    """
+    weather = _snapshot_city("weather_latest", city, dt_partition)
+    if weather is None:
+        return None
+    return weather.sort_values("dt_text", ignore_index=True)
+
+
+def snapshot_forecast(city: str, dt_partition: str) -> tuple:
+    """
+    Filters the full forecast of a city and its daily rollup out of the latest
+    snapshot, None when the snapshot does not hold that day. The forecast is
+    fetched along with the weather of the snapshot, so a city without rows had
+    no full forecast stored and both frames are empty.
+    """
+    tables = snapshot()
+    names = ["weather_latest", "weather_forecast_latest", "weather_forecast_daily_latest"]
+    if tables is None or any(name not in tables for name in names):
+        return None
+    days = pc.unique(tables["weather_latest"]["dt_partition"]).to_pylist()
+    if [str(day) for day in days] != [dt_partition]:
+        return None
+    frames = []
+    for name in names[1:]:
+        rows = tables[name]
+        rows = rows.filter(pc.equal(rows["city"], city))
+        frames.append(partition_as_text(rows.to_pandas()))
+    return tuple(frames)
+
+
+@st.cache_data(ttl=VERSION_TTL)
+def _database_version() -> str:
+    # the rollup is refreshed with each load, hotels may be a view
+    query = text(
+        "SELECT (SELECT MAX(dt_partition) FROM city_rating_daily), "
+        "(SELECT MAX(loaded_at) FROM etl_state)"
+    )
+    with get_engine().connect() as connection:
+        partition, loaded_at = connection.execute(query).one()
+    return f"{partition}|{loaded_at}"
+
+
+def data_version() -> str:
+    """
+    Identifies the data currently served.\n
+    With snapshots, it is the version of the latest one and the database is
+    not reached at all. Otherwise it is built from the latest dt_partition and
+    the last ETL load time, so it changes as soon as the ETL lands new rows.
+    That version is itself cached for VERSION_TTL seconds, so most reruns do
+    not reach the database at all.
+    """
+    return snapshot_version() or _database_version()
+
+
+@st.cache_resource(ttl=DATA_TTL, max_entries=1)
+def _load_rollups(version: str) -> tuple:
+    """
+    Loads the daily rollup tables maintained by the ETL, their size only grows
+    with the number of days and cities.
+    """
+    tables = snapshot()
+    if tables is not None:
+        return (partition_as_text(tables["city_rating_daily"].to_pandas()),
+                partition_as_text(tables["weather_city_daily"].to_pandas()))
+    engine = get_engine()
+    city_rating = partition_as_text(
+        pd.read_sql("SELECT * FROM city_rating_daily", con=engine))
+    weather_city = partition_as_text(
+        pd.read_sql("SELECT * FROM weather_city_daily", con=engine))
+    return city_rating, with_coordinates(city_rating, weather_city)
+
+
+def load_rollups() -> tuple:
+    """
+    Returns the city_rating_daily and weather_city_daily frames, the latter
+    with the city coordinates, reloaded only when the ETL landed new data.
+    """
+    return _load_rollups(data_version())
@@ -1,20 +1,18 @@
-import os
 import streamlit as st
-import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from data import load_rollups
+from queries import (PAGE_SIZE, cities, city_forecast, city_hotels, city_weather,
+                     hotel_history, rating_distribution)
 
 st.set_page_config(layout="wide")
 load_dotenv()
-postgres = os.getenv("POSTGRES")
-engine = create_engine(postgres)
 
-hotels = pd.read_sql("SELECT * FROM hotels", con=engine)
-weather = pd.read_sql("SELECT * FROM weather", con=engine)
-geo = hotels[["city", "lat", "lon"]]
-geo = geo.drop_duplicates(subset="city")
-weather = weather.merge(geo, on="city", how="left").dropna(axis=0)
+city_rating_daily, weather_city_daily = load_rollups()
+city_totals = city_rating_daily.groupby("city", as_index=False).agg(
+    {"rating_sum": "sum", "rating_count": "sum", "reviews_sum": "sum"}
+)
 
 
 def center_text(text, title):
@@ -45,8 +43,8 @@ if navigation == "Hotels information":
 
     col1, col2 = st.columns([1, 1])
     with col1:
-        city_rating = hotels.groupby(
-            "city", as_index=False).agg({"rating": "mean"})
+        city_rating = city_totals.assign(
+            rating=city_totals["rating_sum"] / city_totals["rating_count"])
         city_rating = city_rating.sort_values(by="rating", ascending=True)
         fig = px.bar(city_rating, x="city", y="rating")
         fig.update_layout(
@@ -54,14 +52,15 @@ if navigation == "Hotels information":
         )
         st.plotly_chart(fig)
 
-        mean_ratings = hotels.groupby("city")["rating"].median().reset_index()
-        mean_ratings_sorted = mean_ratings.sort_values(by="rating")
-        fig = px.box(
-            hotels,
-            x="city",
-            y="rating",
-            category_orders={"city": mean_ratings_sorted["city"]},
-        )
+        distribution = rating_distribution()
+        fig = go.Figure(go.Box(
+            x=distribution["city"],
+            q1=distribution["q1"],
+            median=distribution["median"],
+            q3=distribution["q3"],
+            lowerfence=distribution["lowerfence"],
+            upperfence=distribution["upperfence"],
+        ))
         fig.update_layout(
             title="Distribution of ratings by city",
             yaxis_title="Rating",
@@ -70,9 +69,7 @@ if navigation == "Hotels information":
         st.plotly_chart(fig)
 
     with col2:
-        sum_city_reviews = hotels.groupby("city", as_index=False).agg(
-            {"reviews": "sum"}
-        )
+        sum_city_reviews = city_totals.rename(columns={"reviews_sum": "reviews"})
         sum_city_reviews = sum_city_reviews.sort_values(
             "reviews", ascending=False)
         fig = px.bar(sum_city_reviews, x="city", y="reviews")
@@ -83,7 +80,8 @@ if navigation == "Hotels information":
         )
         st.plotly_chart(fig)
 
-        rating_over_time = hotels.groupby('dt_partition', as_index=False).agg({'rating': 'mean','lat': 'mean','lon': 'mean'})
+        rating_over_time = city_rating_daily.groupby('dt_partition', as_index=False).agg({'rating_sum': 'sum', 'rating_count': 'sum'})
+        rating_over_time['rating'] = rating_over_time['rating_sum'] / rating_over_time['rating_count']
         fig = px.line(rating_over_time, x='dt_partition', y='rating')
         fig.update_layout(
                     title='Evolution of rating over time',
@@ -92,8 +90,17 @@ if navigation == "Hotels information":
                 )
         st.plotly_chart(fig)
 
-    city = st.selectbox("Choose a city", sorted(hotels["city"].unique()))
-    selected_city = hotels[hotels["city"] == city]
+    city_partitions = cities()
+    city = st.selectbox("Choose a city", city_partitions["city"])
+    city_partition = city_partitions.loc[
+        city_partitions["city"] == city, "dt_partition"].iloc[0]
+    _, total = city_hotels(city, city_partition)
+    page = 1
+    if total > PAGE_SIZE:
+        page = st.number_input(
+            f"Page ({total} hotels)", min_value=1,
+            max_value=(total - 1) // PAGE_SIZE + 1, value=1)
+    selected_city, _ = city_hotels(city, city_partition, page - 1)
     fig = px.scatter_mapbox(
         selected_city,
         lat="lat",
@@ -110,10 +117,7 @@ if navigation == "Hotels information":
 
     hotel = st.selectbox("Choose a hotel", sorted(
         selected_city["name"].unique()))
-    selected_hotel = selected_city[selected_city["name"] == hotel]
-    selected_hotel_latest = selected_hotel[
-        selected_hotel["dt_partition"] == selected_hotel["dt_partition"].max()
-    ]
+    selected_hotel_latest = selected_city[selected_city["name"] == hotel]
 
     col1, col2 = st.columns([1, 1])
     with col1:
@@ -137,12 +141,10 @@ if navigation == "Hotels information":
         fig.update_layout(height=300)
         st.plotly_chart(fig)
 
-        rating_over_time = selected_hotel.groupby("dt_partition", as_index=False).agg(
-            {"rating": "mean"}
-        )
+        rating_over_time = hotel_history(hotel, city)
         fig = px.line(rating_over_time, x="dt_partition", y="rating")
         fig.update_layout(height=300)
-        mean = hotels.rating.mean()
+        mean = city_totals["rating_sum"].sum() / city_totals["rating_count"].sum()
         # fig.add_hline(y=mean)
         st.plotly_chart(fig, height=100)
 
@@ -165,10 +167,9 @@ if navigation == "Weather":
 
         date = selected_date.strftime("%Y-%m-%d")
 
-        date_weather = weather[weather["dt_partition"] == date]
-        date_weather_grouped = date_weather.groupby("city", as_index=False).agg(
-            {"temps": "mean", "feels_like": "mean", "lat": "first", "lon": "first"}
-        )
+        date_weather_grouped = weather_city_daily[
+            weather_city_daily["dt_partition"] == date
+        ].dropna(subset=["lat", "lon"])
         date_weather_grouped["point_size"] = 20
 
         fig = px.scatter_mapbox(
@@ -189,16 +190,17 @@ if navigation == "Weather":
 
     with col2:
         selected_city = st.selectbox(
-            "Choose a city", sorted(date_weather["city"].unique())
+            "Choose a city", sorted(date_weather_grouped["city"].unique())
         )
 
         st.text(f"""Here is the weather for {
                 selected_city} over the next five days:""")
-        filtered_df = date_weather[date_weather["city"] == selected_city]
-        filtered_df = filtered_df.drop(
-            ["sunrise", "sunset", "lat", "lon", "dt_partition"], axis=1
-        )
-        st.write(filtered_df)
+        filtered_df, daily = city_forecast(selected_city, date)
+        if filtered_df.empty:
+            filtered_df = city_weather(selected_city, date)
+            st.write(filtered_df)
+        else:
+            st.write(daily)
 
         fig = px.line(filtered_df, x="dt_text", y=["temps", "feels_like"])
         fig.update_layout(
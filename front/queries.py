@@ -0,0 +1,162 @@
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+from data import (DATA_TTL, data_version, get_engine, load_rollups, partition_as_text,
+                  snapshot_forecast, snapshot_frame, snapshot_hotels, snapshot_weather)
+
+PAGE_SIZE = 200
+HOTEL_COLUMNS = [
+    "name", "city", "rating", "description", "reviews", "url", "personnel",
+    "equipments", "property", "comfort", "value", "location", "wifi", "lat",
+    "lon", "dt_partition",
+]
+WEATHER_COLUMNS = ["city", "weather", "temps", "feels_like", "dt_text", "daylight"]
+FORECAST_DAILY_COLUMNS = ["day", "temps_min", "temps_max", "temps_mean", "feels_like_mean"]
+
+
+def _read(query: str, params: dict) -> pd.DataFrame:
+    with get_engine().connect() as connection:
+        return pd.read_sql(text(query), connection, params=params)
+
+
+def cities() -> pd.DataFrame:
+    """
+    Lists the cities with the latest partition holding their hotels, derived
+    from the cached city_rating_daily rollup, itself read from the snapshot
+    when there is one.\n
+    Returns:
+        pd.DataFrame: city and dt_partition columns, sorted by city.
+    """
+    city_rating, _ = load_rollups()
+    latest = city_rating.groupby("city", as_index=False)["dt_partition"].max()
+    return latest.sort_values("city", ignore_index=True)
+
+
+@st.cache_data(ttl=DATA_TTL, max_entries=64)
+def _city_hotels(version: str, city: str, dt_partition: str, page: int) -> tuple:
+    hotels = snapshot_hotels(city, dt_partition)
+    if hotels is not None:
+        start = page * PAGE_SIZE
+        return hotels[HOTEL_COLUMNS].iloc[start:start + PAGE_SIZE], len(hotels)
+    params = {"city": city, "dt_partition": dt_partition}
+    # filters match the city index and prune every other partition
+    where = "WHERE city = :city AND dt_partition = CAST(:dt_partition AS date)"
+    total = _read(f"SELECT COUNT(*) AS hotels FROM hotels {where}", params)
+    hotels = _read(
+        f"SELECT {', '.join(HOTEL_COLUMNS)} FROM hotels {where} "
+        "ORDER BY name LIMIT :limit OFFSET :offset",
+        {**params, "limit": PAGE_SIZE, "offset": page * PAGE_SIZE},
+    )
+    return partition_as_text(hotels), int(total["hotels"].iloc[0])
+
+
+def city_hotels(city: str, dt_partition: str, page: int = 0) -> tuple:
+    """
+    Fetches one page of the hotels of a city on a given day, from the latest
+    snapshot when it holds that day.\n
+    Args:
+        city (str): Name of the city.
+        dt_partition (str): Day to read, as YYYY-MM-DD.
+        page (int, optional): Page number, starting at 0. Defaults to 0.
+    Returns:
+        tuple: The hotels of the page, sorted by name, and the number of hotels
+        of the city on that day.
+    """
+    return _city_hotels(data_version(), city, dt_partition, page)
+
+
+@st.cache_data(ttl=DATA_TTL, max_entries=64)
+def _hotel_history(version: str, name: str, city: str) -> pd.DataFrame:
+    # snapshots only hold the latest day, the history is always read from the
+    # database, served by the (name, dt_partition) primary key of each partition
+    return partition_as_text(_read(
+        "SELECT dt_partition, rating, reviews FROM hotels "
+        "WHERE name = :name AND city = :city ORDER BY dt_partition",
+        {"name": name, "city": city},
+    ))
+
+
+def hotel_history(name: str, city: str) -> pd.DataFrame:
+    """
+    Fetches the daily rating and reviews of one hotel from the database, a
+    hotel being identified by its name and city.
+    """
+    return _hotel_history(data_version(), name, city)
+
+
+@st.cache_data(ttl=DATA_TTL, max_entries=4)
+def _rating_distribution(version: str) -> pd.DataFrame:
+    distribution = snapshot_frame("rating_distribution")
+    if distribution is not None:
+        return distribution
+    return _read(
+        "SELECT city, MIN(rating) AS lowerfence, "
+        "percentile_cont(0.25) WITHIN GROUP (ORDER BY rating) AS q1, "
+        "percentile_cont(0.5) WITHIN GROUP (ORDER BY rating) AS median, "
+        "percentile_cont(0.75) WITHIN GROUP (ORDER BY rating) AS q3, "
+        "MAX(rating) AS upperfence "
+        "FROM hotels GROUP BY city ORDER BY median",
+        {},
+    )
+
+
+def rating_distribution() -> pd.DataFrame:
+    """
+    Computes the rating quartiles of each city over every day, read from the
+    snapshot or computed in the database, so only one row per city reaches
+    the front.
+    """
+    return _rating_distribution(data_version())
+
+
+@st.cache_data(ttl=DATA_TTL, max_entries=64)
+def _city_weather(version: str, city: str, dt_partition: str) -> pd.DataFrame:
+    weather = snapshot_weather(city, dt_partition)
+    if weather is not None:
+        return weather[WEATHER_COLUMNS]
+    return _read(
+        f"SELECT {', '.join(WEATHER_COLUMNS)} FROM weather "
+        "WHERE city = :city AND dt_partition = CAST(:dt_partition AS date) "
+        "ORDER BY dt_text",
+        {"city": city, "dt_partition": dt_partition},
+    )
+
+
+def city_weather(city: str, dt_partition: str) -> pd.DataFrame:
+    """
+    Fetches the forecasts of one city made on a given day, from the latest
+    snapshot when it holds that day.
+    """
+    return _city_weather(data_version(), city, dt_partition)
+
+
+@st.cache_data(ttl=DATA_TTL, max_entries=64)
+def _city_forecast(version: str, city: str, dt_partition: str) -> tuple:
+    forecast = snapshot_forecast(city, dt_partition)
+    if forecast is not None:
+        readings, daily = forecast
+        return (readings.sort_values("dt_text", ignore_index=True)[WEATHER_COLUMNS],
+                daily.sort_values("day", ignore_index=True)[FORECAST_DAILY_COLUMNS])
+    params = {"city": city, "dt_partition": dt_partition}
+    where = "WHERE city = :city AND dt_partition = CAST(:dt_partition AS date)"
+    readings = _read(
+        f"SELECT {', '.join(WEATHER_COLUMNS)} FROM weather_forecast {where} ORDER BY dt_text",
+        params,
+    )
+    daily = _read(
+        f"SELECT {', '.join(FORECAST_DAILY_COLUMNS)} "
+        f"FROM weather_forecast_daily {where} ORDER BY day",
+        params,
+    )
+    return readings, daily
+
+
+def city_forecast(city: str, dt_partition: str) -> tuple:
+    """
+    Fetches the full resolution forecast of one city made on a given day, from
+    the latest snapshot when it holds that day.\n
+    Returns:
+        tuple: The 3 hourly readings and the daily min, max and mean
+        temperatures, both empty when the full forecast was not stored.
+    """
+    return _city_forecast(data_version(), city, dt_partition)